@@ -0,0 +1,256 @@
+"""
+Achievements engine for IndianDuo
+
+Rules are declared as data and compiled once into an index keyed by the
+event type they react to, then by the metric they watch. Each metric keeps
+its thresholds sorted, so an event only touches the rules whose threshold
+was crossed between the metric's old and new value.
+"""
+
+from bisect import bisect_right
+from collections import defaultdict
+import asyncio
+import sys
+
+# Event types
+LESSON_COMPLETED = "lesson_completed"
+SUBSCRIBED = "subscribed"
+
+ACHIEVEMENTS = [
+    {"id": "first_lesson", "name": "First Steps", "description": "Complete your first lesson",
+     "event": LESSON_COMPLETED, "metric": "lessons_completed", "threshold": 1},
+    {"id": "lessons_50", "name": "Bookworm", "description": "Complete 50 lessons",
+     "event": LESSON_COMPLETED, "metric": "lessons_completed", "threshold": 50},
+    {"id": "streak_3", "name": "On Fire", "description": "Reach a 3 day streak",
+     "event": LESSON_COMPLETED, "metric": "current_streak", "threshold": 3},
+    {"id": "streak_7", "name": "Week Warrior", "description": "Reach a 7 day streak",
+     "event": LESSON_COMPLETED, "metric": "current_streak", "threshold": 7},
+    {"id": "streak_30", "name": "Unstoppable", "description": "Reach a 30 day streak",
+     "event": LESSON_COMPLETED, "metric": "current_streak", "threshold": 30},
+    {"id": "xp_100", "name": "Rising Star", "description": "Earn 100 XP",
+     "event": LESSON_COMPLETED, "metric": "total_xp", "threshold": 100},
+    {"id": "xp_1000", "name": "Scholar", "description": "Earn 1,000 XP",
+     "event": LESSON_COMPLETED, "metric": "total_xp", "threshold": 1000},
+    {"id": "xp_5000", "name": "Pandit", "description": "Earn 5,000 XP",
+     "event": LESSON_COMPLETED, "metric": "total_xp", "threshold": 5000},
+    {"id": "language_lessons_10", "name": "Dedicated Learner", "description": "Complete 10 lessons in one language",
+     "event": LESSON_COMPLETED, "metric": "language_lessons", "threshold": 10},
+    {"id": "language_lessons_100", "name": "Fluent", "description": "Complete 100 lessons in one language",
+     "event": LESSON_COMPLETED, "metric": "language_lessons", "threshold": 100},
+    {"id": "perfect_score", "name": "Flawless", "description": "Finish a lesson with a perfect score",
+     "event": LESSON_COMPLETED, "metric": "perfect_scores", "threshold": 1},
+    {"id": "perfect_scores_10", "name": "Perfectionist", "description": "Finish 10 lessons with a perfect score",
+     "event": LESSON_COMPLETED, "metric": "perfect_scores", "threshold": 10},
+    {"id": "supporter", "name": "Supporter", "description": "Subscribe to a paid plan",
+     "event": SUBSCRIBED, "metric": "subscribed", "threshold": 1},
+]
+
+PERFECT_SCORE = 100
+
+def compile_rules(rules):
+    """Build {event: {metric: (sorted thresholds, rule ids)}} from rule definitions"""
+    grouped = defaultdict(lambda: defaultdict(list))
+    for rule in rules:
+        grouped[rule["event"]][rule["metric"]].append((rule["threshold"], rule["id"]))
+
+    index = {}
+    for event_type, metrics in grouped.items():
+        index[event_type] = {}
+        for metric, entries in metrics.items():
+            entries.sort()
+            index[event_type][metric] = (
+                [threshold for threshold, _ in entries],
+                [rule_id for _, rule_id in entries],
+            )
+    return index
+
+RULE_INDEX = compile_rules(ACHIEVEMENTS)
+
+def evaluate(event_type, metrics, unlocked=(), index=RULE_INDEX):
+    """Return the achievement ids newly reached by an event.
+
+    `metrics` maps a metric name to a (before, after) pair. Only thresholds in
+    the half-open range (before, after] are visited; pass before=None for
+    metrics that are not cumulative (e.g. a single lesson's score).
+    """
+    by_metric = index.get(event_type)
+    if not by_metric:
+        return []
+
+    unlocked = set(unlocked)
+    reached = []
+    for metric, (before, after) in metrics.items():
+        entry = by_metric.get(metric)
+        if entry is None or after is None:
+            continue
+        thresholds, rule_ids = entry
+        start = 0 if before is None else bisect_right(thresholds, before)
+        end = bisect_right(thresholds, after)
+        for rule_id in rule_ids[start:end]:
+            if rule_id not in unlocked:
+                reached.append(rule_id)
+    return reached
+
+async def award_many(db, events):
+    """Evaluate events (dicts with user_id, event, metrics and unlocked) and persist new unlocks"""
+    from pymongo import UpdateOne
+
+    operations = []
+    for event in events:
+        reached = evaluate(event["event"], event["metrics"], event.get("unlocked", ()))
+        if reached:
+            operations.append(UpdateOne(
+                {"id": event["user_id"]},
+                {"$addToSet": {"achievements": {"$each": reached}}}
+            ))
+    if operations:
+        await db.users.bulk_write(operations, ordered=False)
+    return len(operations)
+
+def lesson_completed_metrics(user, xp_gained, score, language_id, new_streak, first_completion):
+    """Metrics for a lesson completion, given the user document from before the update.
+
+    Repeating a lesson earns XP and can count as a perfect score, but only
+    the first completion counts towards lessons completed.
+    """
+    stats = user.get("stats", {})
+    total_xp = user.get("total_xp", 0)
+    lessons_completed = stats.get("lessons_completed", 0)
+    perfect_scores = stats.get("perfect_scores", 0)
+    metrics = {
+        "total_xp": (total_xp, total_xp + xp_gained),
+        "current_streak": (user.get("current_streak", 0), new_streak),
+    }
+    if score >= PERFECT_SCORE:
+        metrics["perfect_scores"] = (perfect_scores, perfect_scores + 1)
+    if not first_completion:
+        return metrics
+    metrics["lessons_completed"] = (lessons_completed, lessons_completed + 1)
+    if language_id:
+        language_lessons = stats.get("language_lessons", {}).get(language_id, 0)
+        metrics["language_lessons"] = (language_lessons, language_lessons + 1)
+    return metrics
+
+def lesson_completed_counters(score, language_id, first_completion):
+    """$inc counters that keep lesson_completed_metrics O(1) to compute"""
+    counters = {}
+    if score >= PERFECT_SCORE:
+        counters["stats.perfect_scores"] = 1
+    if not first_completion:
+        return counters
+    counters["stats.lessons_completed"] = 1
+    if language_id:
+        counters[f"stats.language_lessons.{language_id}"] = 1
+    return counters
+
+# Replay
+async def replay(db, batch_size=500, dry_run=False):
+    """Evaluate every rule against historical data and backfill achievements.
+
+    Users are walked in batches; each batch costs one query over
+    lesson_progress and one bulk_write, regardless of the number of rules.
+    """
+    from pymongo import UpdateOne
+
+    lesson_languages = {}
+    async for lesson in db.lessons.find({}, {"_id": 0, "id": 1, "language_id": 1}):
+        lesson_languages[lesson["id"]] = lesson.get("language_id")
+
+    projection = {"_id": 0, "id": 1, "total_xp": 1, "longest_streak": 1, "achievements": 1, "stats": 1}
+    totals = {"users": 0, "updated": 0, "unlocked": 0}
+    batch = []
+
+    async def flush(users):
+        user_ids = [user["id"] for user in users]
+        user_stats = defaultdict(lambda: {"lessons_completed": 0, "perfect_scores": 0, "language_lessons": defaultdict(int)})
+        # One completed summary per distinct lesson; perfect scores count every
+        # attempt, which summaries keep even after raw attempts are archived
+        async for summary in db.lesson_progress.find({"user_id": {"$in": user_ids}, "completed": True}):
+            stats = user_stats[summary["user_id"]]
+            stats["lessons_completed"] += 1
+            stats["perfect_scores"] += summary.get("perfect_attempts", 0)
+            language_id = lesson_languages.get(summary["lesson_id"])
+            if language_id:
+                stats["language_lessons"][language_id] += 1
+
+        subscribers = set(await db.user_subscriptions.distinct("user_id", {"user_id": {"$in": user_ids}}))
+
+        operations = []
+        for user in users:
+            stats = user_stats[user["id"]]
+            lesson_metrics = {
+                "total_xp": (None, user.get("total_xp", 0)),
+                "current_streak": (None, user.get("longest_streak", 0)),
+                "lessons_completed": (None, stats["lessons_completed"]),
+                "perfect_scores": (None, stats["perfect_scores"]),
+                "language_lessons": (None, max(stats["language_lessons"].values(), default=0)),
+            }
+            unlocked = user.get("achievements", [])
+            reached = evaluate(LESSON_COMPLETED, lesson_metrics, unlocked)
+            if user["id"] in subscribers:
+                reached += evaluate(SUBSCRIBED, {"subscribed": (None, 1)}, unlocked)
+
+            # Counters maintained by complete_lesson are only raised: summaries
+            # can lag them while outbox jobs are pending, and $max never loses
+            # an increment made since
+            current = user.get("stats", {})
+            current_languages = current.get("language_lessons", {})
+            raised = {
+                f"stats.{name}": stats[name]
+                for name in ("lessons_completed", "perfect_scores")
+                if stats[name] > current.get(name, 0)
+            }
+            for language_id, count in stats["language_lessons"].items():
+                if count > current_languages.get(language_id, 0):
+                    raised[f"stats.language_lessons.{language_id}"] = count
+            update = {}
+            if raised:
+                update["$max"] = raised
+            if reached:
+                totals["unlocked"] += len(reached)
+                update["$addToSet"] = {"achievements": {"$each": reached}}
+            if update:
+                operations.append(UpdateOne({"id": user["id"]}, update))
+
+        totals["users"] += len(users)
+        totals["updated"] += len(operations)
+        if operations and not dry_run:
+            await db.users.bulk_write(operations, ordered=False)
+
+    async for user in db.users.find({}, projection).sort("id", 1):
+        batch.append(user)
+        if len(batch) >= batch_size:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+
+    return totals
+
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="IndianDuo achievements tools")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    replay_parser = subcommands.add_parser("replay", help="Backfill achievements from historical data")
+    replay_parser.add_argument("--batch-size", type=int, default=500)
+    replay_parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    import progress
+    from server import db
+
+    async def run():
+        # Fold raw attempts first so summaries include all recorded history
+        if not args.dry_run:
+            await progress.compact(db)
+        return await replay(db, batch_size=args.batch_size, dry_run=args.dry_run)
+
+    if args.command == "replay":
+        totals = asyncio.run(run())
+        action = "would unlock" if args.dry_run else "unlocked"
+        print(f"Scanned {totals['users']} users, {action} {totals['unlocked']} achievements, {totals['updated']} users changed")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,77 @@
+"""
+Cold start benchmark for the IndianDuo backend
+
+Starts uvicorn in a fresh process, polls /api/health until it answers and
+fails if the median time from process start to the first healthy response
+exceeds the budget.
+
+Startup creates indexes and seeds plans and languages before the server
+answers, so MONGO_URL must point at a reachable MongoDB; the measured time
+includes those round trips.
+
+Usage:
+    python bench_cold_start.py
+    python bench_cold_start.py --runs 10 --budget 1.5
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+COLD_START_BUDGET = float(os.getenv("COLD_START_BUDGET", "3.0"))
+POLL_INTERVAL = 0.01
+
+def cold_start(port, timeout):
+    """Seconds from spawning the server to its first successful health check"""
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {process.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/health", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except (urllib.error.URLError, ConnectionError):
+                pass
+            time.sleep(POLL_INTERVAL)
+        raise RuntimeError(f"Server not healthy after {timeout}s; is MongoDB reachable at MONGO_URL?")
+    finally:
+        process.terminate()
+        process.wait()
+
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Measure backend cold start time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--budget", type=float, default=COLD_START_BUDGET, help="Maximum median seconds")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args(argv)
+
+    timings = []
+    for run in range(1, args.runs + 1):
+        seconds = cold_start(args.port, args.timeout)
+        timings.append(seconds)
+        print(f"run {run}: {seconds * 1000:.0f} ms")
+
+    median = statistics.median(timings)
+    print(f"min {min(timings) * 1000:.0f} ms, median {median * 1000:.0f} ms, budget {args.budget * 1000:.0f} ms")
+    if median > args.budget:
+        print("FAIL: cold start over budget")
+        return 1
+    print("PASS")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
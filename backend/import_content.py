@@ -0,0 +1,364 @@
+"""
+Bulk content import for IndianDuo
+
+Streams lessons or exercises from JSON, NDJSON or CSV files (optionally
+gzipped), validates them in batches against the Lesson/Exercise models and
+upserts them with bulk_write, keeping a bounded number of batches in flight.
+Imported rows are also applied to the search index (see search.py), and
+lesson files are checked for unknown prerequisites and cycles before
+anything is written.
+
+Usage:
+    python import_content.py lessons course/lessons.ndjson
+    python import_content.py exercises course/exercises.csv --batch-size 5000 --concurrency 8
+    python import_content.py exercises course/exercises.json.gz --dry-run
+"""
+
+from datetime import datetime
+from typing import List, get_origin
+import asyncio
+import csv
+import gzip
+import io
+import json
+import sys
+import time
+
+import lesson_graph
+import search
+
+CSV_LIST_SEPARATOR = "|"
+JSON_READ_SIZE = 1 << 16
+DIFF_SAMPLE_SIZE = 5
+
+def open_text(path):
+    if path.endswith(".gz"):
+        return io.TextIOWrapper(gzip.open(path, "rb"), encoding="utf-8")
+    return open(path, "r", encoding="utf-8", newline="")
+
+def detect_format(path):
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    if name.endswith(".csv"):
+        return "csv"
+    return "json"
+
+class ImportAborted(ValueError):
+    """Raised by --strict on the first batch with invalid rows"""
+
+class InvalidRow:
+    """A row a reader could not decode; reported like a validation error"""
+    def __init__(self, message):
+        self.message = message
+
+# Readers yield (row number, dict or InvalidRow) pairs without loading the whole file
+def iter_ndjson(stream):
+    for number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield number, InvalidRow(f"invalid JSON: {e.msg} at column {e.colno}")
+
+def iter_json(stream):
+    """Incrementally decode a top-level JSON array of objects.
+
+    A syntax error is reported as an InvalidRow for the row where it occurs
+    and ends the file, since nothing after it can be located reliably.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    number = 0
+    eof = False
+    expect = "array"  # array, first row, row (after a comma), separator
+
+    while True:
+        # Skip whitespace, refilling the buffer as needed
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n":
+                position += 1
+            if position < len(buffer) or eof:
+                break
+            chunk = stream.read(JSON_READ_SIZE)
+            buffer, position = buffer[position:] + chunk, 0
+            eof = not chunk
+
+        if position >= len(buffer):
+            if expect != "array":
+                yield number + 1, InvalidRow("invalid JSON: unterminated array")
+            return
+        char = buffer[position]
+        if expect == "array":
+            if char != "[":
+                yield 1, InvalidRow("invalid JSON: expected an array of objects")
+                return
+            expect = "first row"
+            position += 1
+            continue
+        if char == "]" and expect in ("first row", "separator"):
+            return
+        if expect == "separator":
+            if char != ",":
+                yield number + 1, InvalidRow(f"invalid JSON: expected ',' or ']' after row {number}")
+                return
+            expect = "row"
+            position += 1
+            continue
+
+        try:
+            row, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError as e:
+            if not eof:
+                chunk = stream.read(JSON_READ_SIZE)
+                buffer, position = buffer[position:] + chunk, 0
+                eof = not chunk
+                continue
+            yield number + 1, InvalidRow(f"invalid JSON: {e.msg}")
+            return
+        if end == len(buffer) and not eof:
+            # A value ending exactly at the buffer end may be a number that
+            # continues in the next chunk
+            chunk = stream.read(JSON_READ_SIZE)
+            buffer, position = buffer[position:] + chunk, 0
+            eof = not chunk
+            continue
+        number += 1
+        position = end
+        expect = "separator"
+        yield number, row
+
+def iter_csv(stream, list_fields):
+    reader = csv.DictReader(stream)
+    for number, row in enumerate(reader, start=2):
+        for field in list_fields:
+            value = row.get(field)
+            if value is not None:
+                row[field] = [item for item in value.split(CSV_LIST_SEPARATOR) if item]
+        # Empty cells fall back to model defaults
+        yield number, {key: value for key, value in row.items() if value != ""}
+
+def list_fields(model):
+    return [name for name, field in model.model_fields.items() if get_origin(field.annotation) in (list, List)]
+
+def iter_rows(path, fmt, model):
+    stream = open_text(path)
+    try:
+        if fmt == "ndjson":
+            yield from iter_ndjson(stream)
+        elif fmt == "csv":
+            yield from iter_csv(stream, list_fields(model))
+        else:
+            yield from iter_json(stream)
+    finally:
+        stream.close()
+
+def iter_batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def validate_batch(model, rows):
+    """Validate raw rows, returning (documents, [(row number, error)])"""
+    from pydantic import ValidationError
+
+    documents = []
+    errors = []
+    for number, row in rows:
+        if isinstance(row, InvalidRow):
+            errors.append((number, row.message))
+            continue
+        try:
+            documents.append(model.model_validate(row).model_dump())
+        except ValidationError as e:
+            errors.append((number, e.errors(include_url=False)))
+    return documents, errors
+
+async def write_batch(collection, documents):
+    from pymongo import UpdateOne
+
+    operations = [UpdateOne({"id": doc["id"]}, {"$set": doc}, upsert=True) for doc in documents]
+    result = await collection.bulk_write(operations, ordered=False)
+    return {"inserted": result.upserted_count, "updated": result.modified_count}
+
+async def diff_batch(collection, documents):
+    """Compare a batch against stored content without writing anything"""
+    ids = [doc["id"] for doc in documents]
+    existing = {}
+    async for doc in collection.find({"id": {"$in": ids}}, {"_id": 0}):
+        existing[doc["id"]] = doc
+
+    counts = {"new": 0, "changed": 0, "unchanged": 0}
+    changes = []
+    for doc in documents:
+        current = existing.get(doc["id"])
+        if current is None:
+            counts["new"] += 1
+            continue
+        fields = sorted(key for key, value in doc.items() if current.get(key) != value)
+        if fields:
+            counts["changed"] += 1
+            changes.append((doc["id"], fields))
+        else:
+            counts["unchanged"] += 1
+    return counts, changes
+
+async def bump_content_version(db):
+    """Increment the content version so caches keyed on it are invalidated"""
+    from pymongo import ReturnDocument
+
+    meta = await db.meta.find_one_and_update(
+        {"_id": "content_version"},
+        {"$inc": {"version": 1}, "$set": {"updated_at": datetime.utcnow()}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return meta["version"]
+
+async def check_prerequisites(db, path, fmt, model):
+    """Merge the file's prerequisite edges with stored lessons and check them.
+
+    This reads the file once up front; only ids, languages and prerequisites
+    of valid rows are kept, so it stays cheap even for large courses. Rows
+    that will be rejected do not count, so a lesson requiring one is
+    reported as having an unknown prerequisite.
+    """
+    incoming = {}
+    for rows in iter_batches(iter_rows(path, fmt, model), 1000):
+        documents, _ = validate_batch(model, rows)
+        for document in documents:
+            incoming[document["id"]] = {
+                "id": document["id"],
+                "language_id": document["language_id"],
+                "prerequisites": document["prerequisites"],
+            }
+
+    languages = list({lesson["language_id"] for lesson in incoming.values()})
+    lessons = dict(incoming)
+    projection = {"_id": 0, "id": 1, "language_id": 1, "prerequisites": 1}
+    async for lesson in db.lessons.find({"language_id": {"$in": languages}}, projection):
+        lessons.setdefault(lesson["id"], lesson)
+    lesson_graph.check_lessons(list(lessons.values()))
+
+async def import_content(db, kind, path, fmt=None, batch_size=1000, concurrency=4,
+                         dry_run=False, strict=False, log=print):
+    from server import Exercise, Lesson
+
+    model, collection = {
+        "lessons": (Lesson, db.lessons),
+        "exercises": (Exercise, db.exercises),
+    }[kind]
+    fmt = fmt or detect_format(path)
+
+    if kind == "lessons":
+        await check_prerequisites(db, path, fmt, model)
+
+    if not dry_run:
+        await collection.create_index("id", unique=True)
+        search_index = search.SearchIndex.load()
+
+    totals = {"rows": 0, "valid": 0, "invalid": 0, "inserted": 0, "updated": 0,
+              "new": 0, "changed": 0, "unchanged": 0}
+    change_samples = []
+    started = time.perf_counter()
+    semaphore = asyncio.Semaphore(concurrency)
+    pending = set()
+
+    async def process(number, documents):
+        async with semaphore:
+            batch_started = time.perf_counter()
+            if dry_run:
+                counts, changes = await diff_batch(collection, documents)
+                change_samples.extend(changes[:DIFF_SAMPLE_SIZE - len(change_samples)])
+            else:
+                counts = await write_batch(collection, documents)
+                await search.index_content(search_index, db, kind, documents)
+            for key, value in counts.items():
+                totals[key] += value
+            elapsed = time.perf_counter() - batch_started
+            rate = len(documents) / elapsed if elapsed else float("inf")
+            log(f"batch {number}: {len(documents)} rows in {elapsed:.2f}s ({rate:,.0f} rows/s)")
+
+    try:
+        for number, rows in enumerate(iter_batches(iter_rows(path, fmt, model), batch_size), start=1):
+            documents, errors = validate_batch(model, rows)
+            totals["rows"] += len(rows)
+            totals["invalid"] += len(errors)
+            for row_number, error in errors:
+                log(f"row {row_number}: {error}")
+            if errors and strict:
+                raise ImportAborted(f"{len(errors)} invalid rows in batch {number}")
+            totals["valid"] += len(documents)
+            if not documents:
+                continue
+
+            # Keep at most `concurrency` batches in flight so memory stays bounded
+            if len(pending) >= concurrency:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+            pending.add(asyncio.ensure_future(process(number, documents)))
+    finally:
+        # Batches already in flight are finished even when aborting, so
+        # whatever was written is still indexed and versioned
+        outcomes = await asyncio.gather(*pending, return_exceptions=True)
+        if not dry_run and totals["valid"]:
+            search_index.save()
+            totals["content_version"] = await bump_content_version(db)
+    for outcome in outcomes:
+        if isinstance(outcome, Exception):
+            raise outcome
+
+    totals["seconds"] = time.perf_counter() - started
+    totals["changes"] = change_samples
+    return totals
+
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Import IndianDuo course content")
+    parser.add_argument("kind", choices=["lessons", "exercises"])
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["json", "ndjson", "csv"], help="Defaults to the file extension")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=4, help="Batches written in parallel")
+    parser.add_argument("--dry-run", action="store_true", help="Diff against current content without writing")
+    parser.add_argument("--strict", action="store_true", help="Abort on the first invalid batch")
+    args = parser.parse_args(argv)
+
+    from server import db
+
+    try:
+        totals = asyncio.run(import_content(
+            db, args.kind, args.path, fmt=args.format, batch_size=args.batch_size,
+            concurrency=args.concurrency, dry_run=args.dry_run, strict=args.strict,
+        ))
+    except (lesson_graph.CycleError, lesson_graph.MissingPrerequisiteError) as e:
+        print(f"Nothing imported: {e}")
+        return 2
+    except ImportAborted as e:
+        print(f"Import aborted: {e}; batches written before it were kept")
+        return 1
+
+    rate = totals["valid"] / totals["seconds"] if totals["seconds"] else 0
+    print(f"{totals['rows']} rows ({totals['invalid']} invalid) in {totals['seconds']:.1f}s, {rate:,.0f} rows/s")
+    if args.dry_run:
+        print(f"new: {totals['new']}, changed: {totals['changed']}, unchanged: {totals['unchanged']}")
+        for doc_id, fields in totals["changes"]:
+            print(f"  {doc_id}: {', '.join(fields)}")
+    else:
+        print(f"inserted: {totals['inserted']}, updated: {totals['updated']}")
+        if "content_version" in totals:
+            print(f"content version is now {totals['content_version']}")
+    return 1 if totals["invalid"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,266 @@
+"""
+Prerequisite graph and per-user unlock state for lessons
+
+Each language's lessons are loaded once per content version and stored in
+topological order, with every lesson's prerequisites packed into an integer
+bitmask over those positions. A user's completed lessons in a language are
+kept as a bitset in the `lesson_completion` collection, stored as 63-bit
+words so completions can be recorded atomically with $bit.
+"""
+
+from collections import deque
+import time
+
+import progress
+
+WORD_BITS = 63
+VERSION_CHECK_SECONDS = 10
+
+class CycleError(ValueError):
+    def __init__(self, language_id, cycle):
+        self.language_id = language_id
+        self.cycle = cycle
+        super().__init__(f"Prerequisite cycle in language {language_id}: {' -> '.join(cycle)}")
+
+class MissingPrerequisiteError(ValueError):
+    def __init__(self, language_id, missing):
+        self.language_id = language_id
+        self.missing = missing
+        details = ", ".join(f"{lesson_id} -> {', '.join(ids)}" for lesson_id, ids in sorted(missing.items())[:10])
+        super().__init__(f"Unknown prerequisites in language {language_id}: {details}")
+
+def find_cycle(edges, nodes):
+    """Return one cycle among `nodes` as a list of ids (first id repeated at the end)"""
+    state = {}
+    for start in nodes:
+        if start in state:
+            continue
+        stack = [(start, iter(edges.get(start, ())))]
+        path = [start]
+        state[start] = "open"
+        while stack:
+            node, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                state[node] = "done"
+                stack.pop()
+                path.pop()
+            elif state.get(child) == "open":
+                return path[path.index(child):] + [child]
+            elif child not in state and child in nodes:
+                state[child] = "open"
+                stack.append((child, iter(edges.get(child, ()))))
+                path.append(child)
+    return []
+
+def topological_order(language_id, lessons):
+    """Order lessons so prerequisites come first (Kahn's algorithm).
+
+    Prerequisites that are not lessons of this language are left out of the
+    ordering; check_lessons rejects them and LessonGraph keeps their
+    dependents locked. Raises CycleError.
+    """
+    ids = [lesson["id"] for lesson in lessons]
+    known = set(ids)
+    prerequisites = {
+        lesson["id"]: [p for p in lesson.get("prerequisites", []) if p in known and p != lesson["id"]]
+        for lesson in lessons
+    }
+    dependents = {lesson_id: [] for lesson_id in ids}
+    remaining = {}
+    for lesson_id, required in prerequisites.items():
+        remaining[lesson_id] = len(required)
+        for prerequisite in required:
+            dependents[prerequisite].append(lesson_id)
+
+    queue = deque(lesson_id for lesson_id in ids if remaining[lesson_id] == 0)
+    order = []
+    while queue:
+        lesson_id = queue.popleft()
+        order.append(lesson_id)
+        for dependent in dependents[lesson_id]:
+            remaining[dependent] -= 1
+            if remaining[dependent] == 0:
+                queue.append(dependent)
+
+    if len(order) != len(ids):
+        stuck = {lesson_id for lesson_id in ids if remaining[lesson_id] > 0}
+        raise CycleError(language_id, find_cycle(prerequisites, stuck))
+    return order
+
+def missing_prerequisites(lessons):
+    """{lesson id: prerequisite ids that are not among `lessons`}"""
+    known = {lesson["id"] for lesson in lessons}
+    missing = {}
+    for lesson in lessons:
+        unknown = [p for p in lesson.get("prerequisites", []) if p not in known]
+        if unknown:
+            missing[lesson["id"]] = unknown
+    return missing
+
+def check_lessons(lessons):
+    """Validate prerequisite graphs for every language in `lessons`.
+
+    Raises MissingPrerequisiteError or CycleError.
+    """
+    by_language = {}
+    for lesson in lessons:
+        by_language.setdefault(lesson.get("language_id"), []).append(lesson)
+    for language_id, language_lessons in by_language.items():
+        missing = missing_prerequisites(language_lessons)
+        if missing:
+            raise MissingPrerequisiteError(language_id, missing)
+        topological_order(language_id, language_lessons)
+
+class LessonGraph:
+    SUMMARY_FIELDS = ("id", "unit_id", "title", "description", "type", "difficulty", "xp_reward")
+
+    def __init__(self, language_id, lessons, version=None):
+        self.language_id = language_id
+        self.version = version
+        by_id = {lesson["id"]: lesson for lesson in lessons}
+        order = topological_order(language_id, lessons)
+
+        self.lessons = [{field: by_id[lesson_id].get(field) for field in self.SUMMARY_FIELDS} for lesson_id in order]
+        self.position = {lesson_id: i for i, lesson_id in enumerate(order)}
+        self.prerequisite_masks = []
+        self.dependents = [[] for _ in order]
+        # A bit past the last lesson is never completed, so a lesson whose
+        # prerequisite does not exist stays locked rather than unlocking early
+        unreachable = 1 << len(order)
+        for i, lesson_id in enumerate(order):
+            mask = 0
+            for prerequisite in by_id[lesson_id].get("prerequisites", []):
+                position = self.position.get(prerequisite)
+                if position is None:
+                    mask |= unreachable
+                elif position != i:
+                    mask |= 1 << position
+                    self.dependents[position].append(i)
+            self.prerequisite_masks.append(mask)
+
+    def __len__(self):
+        return len(self.lessons)
+
+    @property
+    def word_count(self):
+        return (len(self.lessons) + WORD_BITS - 1) // WORD_BITS
+
+    def bits_for(self, lesson_ids):
+        bits = 0
+        for lesson_id in lesson_ids:
+            position = self.position.get(lesson_id)
+            if position is not None:
+                bits |= 1 << position
+        return bits
+
+    def is_unlocked(self, position, completed):
+        return self.prerequisite_masks[position] & ~completed == 0
+
+    def lesson_map(self, completed):
+        return [
+            {
+                **lesson,
+                "completed": bool(completed >> i & 1),
+                "is_locked": not self.is_unlocked(i, completed),
+            }
+            for i, lesson in enumerate(self.lessons)
+        ]
+
+    def newly_unlocked(self, completed, lesson_id):
+        """Lessons unlocked by completing `lesson_id`, checking only its dependents"""
+        position = self.position[lesson_id]
+        before = completed & ~(1 << position)
+        after = completed | (1 << position)
+        return [
+            self.lessons[dependent]["id"]
+            for dependent in self.dependents[position]
+            if not after >> dependent & 1
+            and self.is_unlocked(dependent, after)
+            and not self.is_unlocked(dependent, before)
+        ]
+
+def to_words(bits, word_count):
+    mask = (1 << WORD_BITS) - 1
+    return [(bits >> (i * WORD_BITS)) & mask for i in range(word_count)]
+
+def from_words(words):
+    bits = 0
+    for i, word in enumerate(words):
+        bits |= word << (i * WORD_BITS)
+    return bits
+
+# Graphs are shared by all requests and dropped when the content version changes
+_graphs = {}
+_content_version = None
+_last_version_check = 0.0
+
+async def get_content_version(db):
+    meta = await db.meta.find_one({"_id": "content_version"})
+    return meta["version"] if meta else 0
+
+async def get_graph(db, language_id):
+    global _content_version, _last_version_check
+    now = time.monotonic()
+    if _content_version is None or now - _last_version_check >= VERSION_CHECK_SECONDS:
+        _last_version_check = now
+        version = await get_content_version(db)
+        if version != _content_version:
+            _graphs.clear()
+            _content_version = version
+
+    graph = _graphs.get(language_id)
+    if graph is None:
+        projection = {"_id": 0, "prerequisites": 1, "language_id": 1, **{field: 1 for field in LessonGraph.SUMMARY_FIELDS}}
+        lessons = await db.lessons.find({"language_id": language_id}, projection).sort("id", 1).to_list(None)
+        graph = LessonGraph(language_id, lessons, _content_version)
+        # Empty graphs are not kept, so requests for unknown ids cannot grow the cache
+        if graph:
+            _graphs[language_id] = graph
+    return graph
+
+async def load_completed(db, graph, user_id, session=None):
+    """The user's completed bitset for a graph, rebuilt from recorded attempts if stale"""
+    if not graph:
+        return 0
+    state = await db.lesson_completion.find_one({"user_id": user_id, "language_id": graph.language_id}, session=session)
+    if state and state.get("version") == graph.version:
+        return from_words(state["words"])
+
+    lesson_ids = [lesson["id"] for lesson in graph.lessons]
+    completed = graph.bits_for(await progress.completed_lesson_ids(db, user_id, lesson_ids, session=session))
+    await db.lesson_completion.update_one(
+        {"user_id": user_id, "language_id": graph.language_id},
+        {"$set": {"version": graph.version, "words": to_words(completed, graph.word_count)}},
+        upsert=True,
+        session=session
+    )
+    return completed
+
+async def record_completion(db, user_id, lesson, session=None):
+    """Mark a lesson completed; returns (first completion, ids of lessons it unlocked).
+
+    Call it before the attempt is recorded, so a rebuild here only sees
+    earlier completions.
+    """
+    graph = await get_graph(db, lesson["language_id"]) if lesson.get("language_id") else None
+    position = graph.position.get(lesson["id"]) if graph else None
+    if position is None:
+        # Not in a cached graph yet; fall back to the recorded attempts
+        return not await progress.completed_lesson_ids(db, user_id, [lesson["id"]], session=session), []
+
+    completed = await load_completed(db, graph, user_id, session=session)
+    if completed >> position & 1:
+        return False, []
+
+    # The bit is set only if still clear, so concurrent completions count once
+    word = position // WORD_BITS
+    mask = 1 << (position % WORD_BITS)
+    result = await db.lesson_completion.update_one(
+        {"user_id": user_id, "language_id": graph.language_id, "version": graph.version, f"words.{word}": {"$bitsAllClear": mask}},
+        {"$bit": {f"words.{word}": {"or": mask}}},
+        session=session
+    )
+    if not result.modified_count:
+        return False, []
+    return True, graph.newly_unlocked(completed, lesson["id"])
@@ -0,0 +1,370 @@
+"""
+Content-addressed media store for IndianDuo
+
+Exercise audio and images are stored on disk under their SHA-256 digest, so
+identical files are kept once no matter how many exercises use them.
+Metadata (type, size, duration, dimensions, variants) is computed at ingest
+time and kept in the `media` collection, and cached in-process so lesson
+bundles and media responses never need to stat the file. Adding a variant
+bumps `meta.media_version`, which servers poll to drop their caches.
+
+Usage:
+    python media.py ingest audio/namaste.ogg images/*.png
+    python media.py ingest audio/namaste.mp3 --variant-of <digest> --variant mp3
+"""
+
+from datetime import datetime
+import asyncio
+import hashlib
+import mimetypes
+import os
+import re
+import stat
+import struct
+import sys
+import tempfile
+import time
+import wave
+
+MEDIA_ROOT = os.getenv("MEDIA_ROOT", os.path.join(os.path.dirname(os.path.abspath(__file__)), "media"))
+MEDIA_URL_PREFIX = "/api/media/"
+CHUNK_SIZE = 1 << 16
+DIGEST_RE = re.compile(r"[0-9a-f]{64}")
+VERSION_CHECK_SECONDS = 10
+
+# Digest -> metadata. Stored bytes never change but the variants map does, so
+# the cache is dropped whenever the media version changes
+_metadata_cache = {}
+_media_version = None
+_last_version_check = 0.0
+
+def is_digest(value):
+    return bool(DIGEST_RE.fullmatch(value))
+
+def media_url(digest):
+    return f"{MEDIA_URL_PREFIX}{digest}"
+
+def find_digest(reference):
+    """Extract the digest from an Exercise.audio_url/image_url value, if any"""
+    match = DIGEST_RE.search(reference or "")
+    return match.group(0) if match else None
+
+def object_path(digest):
+    # Keyed by digest alone: the same bytes ingested as .ogg and .oga are one object
+    return os.path.join(MEDIA_ROOT, "objects", digest[:2], digest[2:4], digest)
+
+# Metadata probes use only the file headers (and, for Ogg, the last page)
+MP3_BITRATES = {
+    # (MPEG-1, layer) and (MPEG-2/2.5, layer) -> kbps by bitrate index
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+PROBE_SIZE = 1 << 16
+
+def mp3_duration(f, file_size):
+    header = f.read(10)
+    audio_start = 0
+    if header[:3] == b"ID3":
+        # Syncsafe size, plus a 10 byte footer when flagged
+        tag_size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+        audio_start = 10 + tag_size + (10 if header[5] & 0x10 else 0)
+    f.seek(audio_start)
+    data = f.read(PROBE_SIZE)
+
+    for offset in range(len(data) - 4):
+        if data[offset] != 0xFF or data[offset + 1] & 0xE0 != 0xE0:
+            continue
+        version_bits = data[offset + 1] >> 3 & 3
+        layer = 4 - (data[offset + 1] >> 1 & 3)
+        bitrate_index = data[offset + 2] >> 4
+        rate_index = data[offset + 2] >> 2 & 3
+        if version_bits == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+            continue
+        mpeg1 = version_bits == 3
+        sample_rate = MP3_SAMPLE_RATES[version_bits][rate_index]
+        samples_per_frame = 384 if layer == 1 else 1152 if mpeg1 or layer == 2 else 576
+        mono = data[offset + 3] >> 6 == 3
+
+        # VBR files carry a frame count in a Xing/Info or VBRI header in the first frame
+        side_info = (17 if mono else 32) if mpeg1 else (9 if mono else 17)
+        xing = offset + 4 + side_info
+        frames = None
+        if data[xing:xing + 4] in (b"Xing", b"Info") and len(data) >= xing + 12:
+            flags = struct.unpack(">I", data[xing + 4:xing + 8])[0]
+            if flags & 1:
+                frames = struct.unpack(">I", data[xing + 8:xing + 12])[0]
+        elif data[offset + 36:offset + 40] == b"VBRI" and len(data) >= offset + 54:
+            frames = struct.unpack(">I", data[offset + 50:offset + 54])[0]
+        if frames:
+            return round(frames * samples_per_frame / sample_rate, 3)
+
+        # Constant bitrate: audio bytes over bytes per second, minus any ID3v1 tag
+        f.seek(max(file_size - 128, 0))
+        tail = 128 if f.read(3) == b"TAG" else 0
+        bitrate = MP3_BITRATES[(1 if mpeg1 else 2, layer)][bitrate_index] * 1000
+        return round((file_size - audio_start - offset - tail) * 8 / bitrate, 3)
+    return None
+
+def ogg_duration(f, file_size):
+    page = f.read(PROBE_SIZE)
+    if page[:4] != b"OggS" or len(page) < 27:
+        return None
+    serial = page[14:18]
+    packet_start = 27 + page[26]
+    packet = page[packet_start:packet_start + 20]
+    if packet[:7] == b"\x01vorbis":
+        rate, pre_skip = struct.unpack("<I", packet[12:16])[0], 0
+    elif packet[:8] == b"OpusHead":
+        # Opus granule positions always count 48 kHz samples
+        rate, pre_skip = 48000, struct.unpack("<H", packet[10:12])[0]
+    else:
+        return None
+
+    # The last page of the stream holds the total sample count
+    f.seek(max(file_size - PROBE_SIZE, 0))
+    tail = f.read(PROBE_SIZE)
+    end = len(tail)
+    while True:
+        offset = tail.rfind(b"OggS", 0, end)
+        if offset < 0 or not rate:
+            return None
+        granule = struct.unpack("<q", tail[offset + 6:offset + 14])[0] if len(tail) >= offset + 18 else -1
+        if tail[offset + 14:offset + 18] == serial and granule >= 0:
+            return round(max(granule - pre_skip, 0) / rate, 3)
+        end = offset
+
+def mp4_duration(f, file_size):
+    """Duration from the movie header (moov/mvhd) of an MP4/M4A file"""
+    def boxes(start, end):
+        position = start
+        while position + 8 <= end:
+            f.seek(position)
+            size, kind = struct.unpack(">I4s", f.read(8))
+            header = 8
+            if size == 1:
+                size = struct.unpack(">Q", f.read(8))[0]
+                header = 16
+            elif size == 0:
+                size = end - position
+            if size < header:
+                return
+            yield kind, position + header, position + size
+            position += size
+
+    for kind, start, end in boxes(0, file_size):
+        if kind != b"moov":
+            continue
+        for child, child_start, _ in boxes(start, end):
+            if child == b"mvhd":
+                f.seek(child_start)
+                version = f.read(4)[0]
+                if version == 1:
+                    timescale, duration = struct.unpack(">16xIQ", f.read(28))
+                else:
+                    timescale, duration = struct.unpack(">8xII", f.read(16))
+                return round(duration / timescale, 3) if timescale else None
+    return None
+
+def audio_duration(path):
+    """Duration in seconds for WAV, MP3, Ogg (Vorbis/Opus) and MP4 audio, sniffed from the header"""
+    file_size = os.path.getsize(path)
+    try:
+        with open(path, "rb") as f:
+            magic = f.read(12)
+            f.seek(0)
+            if magic[:4] == b"RIFF" and magic[8:12] == b"WAVE":
+                with wave.open(f, "rb") as audio:
+                    return round(audio.getnframes() / float(audio.getframerate()), 3)
+            if magic[:4] == b"OggS":
+                return ogg_duration(f, file_size)
+            if magic[4:8] == b"ftyp":
+                return mp4_duration(f, file_size)
+            if magic[:3] == b"ID3" or (magic[0] == 0xFF and magic[1] & 0xE0 == 0xE0):
+                return mp3_duration(f, file_size)
+    except (wave.Error, EOFError, struct.error, IndexError):
+        return None
+    return None
+
+def image_dimensions(path, content_type):
+    with open(path, "rb") as f:
+        header = f.read(26)
+        if content_type == "image/png" and header[:8] == b"\x89PNG\r\n\x1a\n":
+            return struct.unpack(">II", header[16:24])
+        if content_type == "image/gif" and header[:6] in (b"GIF87a", b"GIF89a"):
+            return struct.unpack("<HH", header[6:10])
+        if content_type == "image/jpeg" and header[:2] == b"\xff\xd8":
+            f.seek(2)
+            while True:
+                marker = f.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    return None
+                if marker[1] in (0xD8, 0x01) or 0xD0 <= marker[1] <= 0xD7:
+                    continue
+                length = struct.unpack(">H", f.read(2))[0]
+                # SOF0-SOF15, excluding DHT (C4), JPG (C8) and DAC (CC)
+                if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+                    height, width = struct.unpack(">xHH", f.read(5))
+                    return width, height
+                f.seek(length - 2, os.SEEK_CUR)
+    return None
+
+def describe(path, digest, size, name):
+    """Metadata for a stored object; `name` is the ingested file name, used for its type"""
+    content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    ext = os.path.splitext(name)[1].lower()
+    metadata = {
+        "id": digest,
+        "content_type": content_type,
+        "ext": ext,
+        "size": size,
+        "variants": {},
+        "created_at": datetime.utcnow(),
+    }
+    if content_type.startswith("audio/"):
+        metadata["duration"] = audio_duration(path)
+    elif content_type.startswith("image/"):
+        dimensions = image_dimensions(path, content_type)
+        if dimensions:
+            metadata["width"], metadata["height"] = dimensions
+    return metadata
+
+def store_file(source_path):
+    """Copy a file into the store, returning (digest, stored path, created)"""
+    tmp_dir = os.path.join(MEDIA_ROOT, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    sha256 = hashlib.sha256()
+    with open(source_path, "rb") as source, tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as tmp:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+            sha256.update(chunk)
+            tmp.write(chunk)
+    digest = sha256.hexdigest()
+
+    target = object_path(digest)
+    if os.path.exists(target):
+        os.unlink(tmp.name)
+        return digest, target, False
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.chmod(tmp.name, 0o644)
+    os.replace(tmp.name, target)
+    return digest, target, True
+
+async def ingest(db, source_path, variant_of=None, variant_name=None):
+    """Store a file and record its metadata; re-ingesting the same bytes is a no-op"""
+    digest, path, created = await asyncio.to_thread(store_file, source_path)
+    metadata = await asyncio.to_thread(describe, path, digest, os.path.getsize(path), source_path)
+    await db.media.update_one({"id": digest}, {"$setOnInsert": metadata}, upsert=True)
+
+    if variant_of:
+        await db.media.update_one(
+            {"id": variant_of},
+            {"$set": {f"variants.{variant_name or metadata['ext'].lstrip('.')}": digest}}
+        )
+        _metadata_cache.pop(variant_of, None)
+        await bump_media_version(db)
+    return digest, created
+
+async def bump_media_version(db):
+    """Increment the media version so other processes drop cached metadata"""
+    await db.meta.update_one(
+        {"_id": "media_version"},
+        {"$inc": {"version": 1}, "$set": {"updated_at": datetime.utcnow()}},
+        upsert=True,
+    )
+
+async def get_media_version(db):
+    meta = await db.meta.find_one({"_id": "media_version"})
+    return meta["version"] if meta else 0
+
+async def get_metadata(db, digests):
+    """Metadata for many digests, served from the in-process cache where possible"""
+    global _media_version, _last_version_check
+    now = time.monotonic()
+    if _media_version is None or now - _last_version_check >= VERSION_CHECK_SECONDS:
+        _last_version_check = now
+        version = await get_media_version(db)
+        if version != _media_version:
+            _metadata_cache.clear()
+            _media_version = version
+
+    missing = [digest for digest in set(digests) if digest not in _metadata_cache]
+    if missing:
+        async for doc in db.media.find({"id": {"$in": missing}}, {"_id": 0}):
+            _metadata_cache[doc["id"]] = doc
+    return {digest: _metadata_cache[digest] for digest in digests if digest in _metadata_cache}
+
+def stat_result(metadata):
+    """A synthetic os.stat_result built from the index, so responses skip os.stat"""
+    created_at = metadata.get("created_at") or datetime.utcnow()
+    mtime = int((created_at - datetime(1970, 1, 1)).total_seconds())
+    return os.stat_result((stat.S_IFREG | 0o644, 0, 0, 1, 0, 0, metadata["size"], mtime, mtime, mtime))
+
+def etag(digest):
+    return f'"{digest}"'
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+def parse_range(header, size):
+    """Parse a single `bytes=` range into inclusive (start, end).
+
+    Returns None for a header that should be ignored (malformed, another
+    unit or several ranges), so the full body is sent; raises
+    RangeNotSatisfiable for a valid range that lies outside the file.
+    """
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    start, end = match.groups()
+    if start == "":
+        length = int(end)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable(header)
+        return max(size - length, 0), size - 1
+    start = int(start)
+    if end and int(end) < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    end = min(int(end), size - 1) if end else size - 1
+    return start, end
+
+def iter_file_range(path, start, end):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="IndianDuo media store")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    ingest_parser = subcommands.add_parser("ingest", help="Add audio/image files to the store")
+    ingest_parser.add_argument("paths", nargs="+")
+    ingest_parser.add_argument("--variant-of", help="Digest of the original this file is an alternate encoding of")
+    ingest_parser.add_argument("--variant", help="Variant name, defaults to the file extension")
+    args = parser.parse_args(argv)
+
+    from server import db
+
+    async def run():
+        for path in args.paths:
+            digest, created = await ingest(db, path, args.variant_of, args.variant)
+            print(f"{'stored' if created else 'exists'} {path} -> {media_url(digest)}")
+
+    asyncio.run(run())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
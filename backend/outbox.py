@@ -0,0 +1,232 @@
+"""
+Outbox job pipeline for request side effects
+
+Endpoints publish an event once; every consumer subscribed to it gets a job
+document in the `outbox` collection, written alongside the request's main
+update (inside a transaction when OUTBOX_TRANSACTIONS=1, which needs a
+replica set). Worker coroutines drain the outbox per job type in batches,
+with bounded concurrency, retries with exponential backoff and a lease so
+jobs held by a crashed worker are picked up again.
+
+Set OUTBOX_MODE=sync to run consumers inline instead, e.g. for local tests.
+"""
+
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+import asyncio
+import os
+import uuid
+
+import achievements
+import progress
+
+OUTBOX_MODE = os.getenv("OUTBOX_MODE", "async")  # async, sync
+OUTBOX_TRANSACTIONS = os.getenv("OUTBOX_TRANSACTIONS") == "1"
+MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 2
+LEASE_SECONDS = 60
+POLL_SECONDS = 1.0
+
+# Event types
+LESSON_COMPLETED = achievements.LESSON_COMPLETED
+SUBSCRIBED = achievements.SUBSCRIBED
+
+# Job type -> consumer settings; event type -> subscribed job types
+CONSUMERS = {}
+SUBSCRIPTIONS = defaultdict(list)
+
+# In-process counters reported by metrics()
+_stats = defaultdict(lambda: {"processed": 0, "failed": 0, "batches": 0})
+_wakeups = defaultdict(asyncio.Event)
+_workers = []
+
+def consumer(job_type, events, batch_size=100, concurrency=2):
+    """Register `handler(db, payloads)` to run for each of `events`"""
+    def register(handler):
+        CONSUMERS[job_type] = {"handler": handler, "batch_size": batch_size, "concurrency": concurrency}
+        for event_type in events:
+            SUBSCRIPTIONS[event_type].append(job_type)
+        return handler
+    return register
+
+@asynccontextmanager
+async def transaction(db):
+    """Yield a session whose transaction covers the main update and publish()"""
+    if not OUTBOX_TRANSACTIONS or OUTBOX_MODE == "sync":
+        yield None
+        return
+    async with await db.client.start_session() as session:
+        async with session.start_transaction():
+            yield session
+
+async def publish(db, event_type, payload, session=None):
+    """Queue `payload` for every consumer of `event_type`"""
+    job_types = SUBSCRIPTIONS.get(event_type, [])
+    if OUTBOX_MODE == "sync":
+        for job_type in job_types:
+            await CONSUMERS[job_type]["handler"](db, [payload])
+        return
+
+    now = datetime.utcnow()
+    jobs = [
+        {
+            "id": str(uuid.uuid4()),
+            "job_type": job_type,
+            "event": event_type,
+            "payload": payload,
+            "status": "pending",
+            "attempts": 0,
+            "created_at": now,
+            "available_at": now,
+        }
+        for job_type in job_types
+    ]
+    if jobs:
+        await db.outbox.insert_many(jobs, session=session)
+        for job_type in job_types:
+            _wakeups[job_type].set()
+
+async def claim(db, job_type, limit):
+    """Lease up to `limit` due jobs; three round trips however large the batch"""
+    now = datetime.utcnow()
+    candidates = await db.outbox.find(
+        {"job_type": job_type, "status": "pending", "available_at": {"$lte": now}},
+        {"_id": 1}
+    ).sort("available_at", 1).limit(limit).to_list(None)
+    if not candidates:
+        return []
+
+    lease = str(uuid.uuid4())
+    await db.outbox.update_many(
+        {"_id": {"$in": [job["_id"] for job in candidates]}, "status": "pending"},
+        {
+            "$set": {"status": "running", "lease": lease, "leased_until": now + timedelta(seconds=LEASE_SECONDS)},
+            "$inc": {"attempts": 1}
+        }
+    )
+    return await db.outbox.find({"lease": lease, "status": "running"}).to_list(None)
+
+async def settle(db, jobs, error=None):
+    """Delete finished jobs, or schedule a retry / mark them dead on failure"""
+    if error is None:
+        await db.outbox.delete_many({"_id": {"$in": [job["_id"] for job in jobs]}})
+        return
+
+    from pymongo import UpdateOne
+
+    now = datetime.utcnow()
+    operations = []
+    for job in jobs:
+        if job["attempts"] >= MAX_ATTEMPTS:
+            update = {"status": "dead", "error": error}
+        else:
+            delay = RETRY_BASE_SECONDS * 2 ** (job["attempts"] - 1)
+            update = {"status": "pending", "error": error, "available_at": now + timedelta(seconds=delay)}
+        operations.append(UpdateOne({"_id": job["_id"]}, {"$set": update, "$unset": {"lease": ""}}))
+    await db.outbox.bulk_write(operations, ordered=False)
+
+async def run_batch(db, job_type):
+    """Claim and run one batch; returns the number of jobs handled"""
+    settings = CONSUMERS[job_type]
+    jobs = await claim(db, job_type, settings["batch_size"])
+    if not jobs:
+        return 0
+
+    stats = _stats[job_type]
+    stats["batches"] += 1
+    try:
+        await settings["handler"](db, [job["payload"] for job in jobs])
+    except Exception as e:
+        stats["failed"] += len(jobs)
+        await settle(db, jobs, error=f"{type(e).__name__}: {e}")
+    else:
+        stats["processed"] += len(jobs)
+        await settle(db, jobs)
+    return len(jobs)
+
+async def release_expired_leases(db):
+    await db.outbox.update_many(
+        {"status": "running", "leased_until": {"$lt": datetime.utcnow()}},
+        {"$set": {"status": "pending"}, "$unset": {"lease": ""}}
+    )
+
+async def worker(db, job_type, log=print):
+    wakeup = _wakeups[job_type]
+    while True:
+        try:
+            if await run_batch(db, job_type):
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log(f"outbox worker {job_type} error: {e}")
+        wakeup.clear()
+        try:
+            await asyncio.wait_for(wakeup.wait(), POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+async def lease_reaper(db, log=print):
+    while True:
+        await asyncio.sleep(LEASE_SECONDS)
+        try:
+            await release_expired_leases(db)
+        except Exception as e:
+            log(f"outbox lease reaper error: {e}")
+
+def start_workers(db):
+    """Start `concurrency` workers per job type on the running event loop"""
+    if OUTBOX_MODE == "sync" or _workers:
+        return
+    for job_type, settings in CONSUMERS.items():
+        for _ in range(settings["concurrency"]):
+            _workers.append(asyncio.create_task(worker(db, job_type)))
+    _workers.append(asyncio.create_task(lease_reaper(db)))
+
+async def stop_workers():
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+
+async def ensure_indexes(db):
+    from pymongo import IndexModel
+
+    await db.outbox.create_indexes([
+        IndexModel([("job_type", 1), ("status", 1), ("available_at", 1)]),
+        IndexModel("lease", sparse=True),
+        IndexModel([("status", 1), ("leased_until", 1)]),
+    ])
+
+async def metrics(db):
+    """Queue depth and lag per job type, plus this process's counters"""
+    pipeline = [
+        {"$group": {
+            "_id": {"job_type": "$job_type", "status": "$status"},
+            "count": {"$sum": 1},
+            "oldest": {"$min": "$created_at"},
+        }},
+    ]
+    now = datetime.utcnow()
+    report = {
+        job_type: {"pending": 0, "running": 0, "dead": 0, "lag_seconds": 0.0, **_stats[job_type]}
+        for job_type in CONSUMERS
+    }
+    async for row in db.outbox.aggregate(pipeline):
+        job_type, status = row["_id"]["job_type"], row["_id"]["status"]
+        entry = report.setdefault(job_type, {"pending": 0, "running": 0, "dead": 0, "lag_seconds": 0.0})
+        entry[status] = row["count"]
+        if status in ("pending", "running"):
+            lag = (now - row["oldest"]).total_seconds()
+            entry["lag_seconds"] = max(entry["lag_seconds"], round(lag, 3))
+    return {"mode": OUTBOX_MODE, "job_types": report}
+
+# Consumers
+@consumer("lesson_summary", [LESSON_COMPLETED], batch_size=200, concurrency=2)
+async def fold_lesson_summaries(db, payloads):
+    await progress.fold_attempts(db, [payload["attempt"] for payload in payloads if "attempt" in payload])
+
+@consumer("achievements", [LESSON_COMPLETED, SUBSCRIBED], batch_size=200, concurrency=2)
+async def award_achievements(db, payloads):
+    await achievements.award_many(db, [payload["achievements"] for payload in payloads if "achievements" in payload])
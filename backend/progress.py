@@ -0,0 +1,218 @@
+"""
+Lesson progress summaries, compaction and retention
+
+`user_progress` holds one raw document per lesson attempt. Reads go to
+`lesson_progress` instead, which keeps a single summary per (user, lesson):
+best score, attempt count, merged mistakes and completion times.
+
+Attempts are folded into summaries by fold_attempts, which keeps the ids
+of the last FOLD_WINDOW folded attempts on the summary, so re-folding an
+attempt (an outbox retry, or compaction after a failed mark) is a no-op
+while the summary stays a constant size. complete_lesson folds through
+the outbox; the compaction job folds anything left over, such as
+attempts recorded before summaries existed.
+The retention job moves raw attempts older than the retention window to an
+archive collection or to gzipped NDJSON files. Both jobs work in batches
+and can be interrupted and re-run safely.
+
+Usage:
+    python progress.py compact
+    python progress.py archive --days 90
+    python progress.py archive --days 90 --to-files /var/backups/indianduo
+"""
+
+from datetime import datetime, timedelta
+import asyncio
+import gzip
+import json
+import os
+import sys
+
+PERFECT_SCORE = 100
+BATCH_SIZE = 1000
+RETENTION_DAYS = int(os.getenv("PROGRESS_RETENTION_DAYS", "90"))
+DUPLICATE_KEY = 11000
+# Recently folded attempt ids kept per summary; a re-fold follows its first
+# fold long before this many newer attempts on the same lesson land
+FOLD_WINDOW = 20
+
+def summary_update(attempts):
+    """Fold attempts for one (user, lesson) into a lesson_progress update"""
+    completed = [attempt for attempt in attempts if attempt.get("completed")]
+    completed_times = [attempt["completed_at"] for attempt in completed if attempt.get("completed_at")]
+    mistakes = sorted({mistake for attempt in attempts for mistake in attempt.get("mistakes", [])})
+    update = {
+        "$inc": {
+            "attempts": sum(attempt.get("attempts", 1) for attempt in attempts),
+            "perfect_attempts": sum(1 for attempt in completed if attempt.get("score", 0) >= PERFECT_SCORE),
+        },
+        "$max": {"best_score": max(attempt.get("score", 0) for attempt in attempts)},
+    }
+    if completed:
+        update["$set"] = {"completed": True}
+    else:
+        update["$setOnInsert"] = {"completed": False}
+    if completed_times:
+        update["$min"] = {"first_completed_at": min(completed_times)}
+        update["$max"]["last_completed_at"] = max(completed_times)
+    if mistakes:
+        update["$addToSet"] = {"mistakes": {"$each": mistakes}}
+    return update
+
+async def fold_attempts(db, attempts):
+    """Fold raw attempts into their summaries exactly once, then mark them summarized"""
+    from pymongo import UpdateOne
+    from pymongo.errors import BulkWriteError
+
+    if not attempts:
+        return
+    operations = []
+    for attempt in attempts:
+        update = summary_update([attempt])
+        update["$push"] = {"folded_ids": {"$each": [attempt["id"]], "$slice": -FOLD_WINDOW}}
+        operations.append(UpdateOne(
+            {"user_id": attempt["user_id"], "lesson_id": attempt["lesson_id"], "folded_ids": {"$ne": attempt["id"]}},
+            update,
+            upsert=True
+        ))
+    # A duplicate key means either the summary already includes the attempt,
+    # or a concurrent upsert created the summary first; retrying once tells
+    # the two apart, since the retry's filter now sees the existing summary
+    for _ in range(2):
+        try:
+            await db.lesson_progress.bulk_write(operations, ordered=False)
+            break
+        except BulkWriteError as e:
+            errors = e.details["writeErrors"]
+            if any(error["code"] != DUPLICATE_KEY for error in errors):
+                raise
+            operations = [operations[error["index"]] for error in errors]
+    await db.user_progress.update_many(
+        {"id": {"$in": [attempt["id"] for attempt in attempts]}},
+        {"$set": {"summarized": True}}
+    )
+
+async def record_attempt(db, attempt, session=None):
+    """Store a raw attempt; it is folded into lesson_progress by fold_attempts"""
+    await db.user_progress.insert_one({**attempt, "summarized": False}, session=session)
+
+async def completed_lesson_ids(db, user_id, lesson_ids, session=None):
+    """Ids among `lesson_ids` the user has completed, including attempts not yet folded"""
+    # Pending attempts are read first: one folded in between is then seen in
+    # its summary, while the other order could miss it in both
+    pending = await db.user_progress.distinct(
+        "lesson_id",
+        {"summarized": False, "user_id": user_id, "lesson_id": {"$in": lesson_ids}, "completed": True},
+        session=session
+    )
+    summarized = await db.lesson_progress.distinct(
+        "lesson_id", {"user_id": user_id, "lesson_id": {"$in": lesson_ids}, "completed": True}, session=session
+    )
+    return sorted(set(pending) | set(summarized))
+
+async def ensure_indexes(db):
+    from pymongo import IndexModel
+
+    await asyncio.gather(
+        db.lesson_progress.create_index([("user_id", 1), ("lesson_id", 1)], unique=True),
+        db.user_progress.create_indexes([
+            IndexModel([("summarized", 1), ("_id", 1)]),
+            IndexModel([("summarized", 1), ("completed_at", 1)]),
+            IndexModel("id"),
+        ]),
+    )
+    # Reads go to lesson_progress, so raw attempts no longer need a per-lesson index
+    if "user_id_1_lesson_id_1" in await db.user_progress.index_information():
+        await db.user_progress.drop_index("user_id_1_lesson_id_1")
+
+# Compaction
+async def compact(db, batch_size=BATCH_SIZE, log=print):
+    """Fold raw attempts that are not yet summarized into lesson_progress"""
+    folded = 0
+    while True:
+        attempts = await db.user_progress.find({"summarized": {"$ne": True}}).sort("_id", 1).limit(batch_size).to_list(None)
+        if not attempts:
+            return folded
+        await fold_attempts(db, attempts)
+        folded += len(attempts)
+        log(f"compacted {folded} attempts")
+
+# Retention
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def write_archive_file(directory, attempts):
+    """Write a batch as gzipped NDJSON, named after its first _id so re-runs overwrite it"""
+    os.makedirs(directory, exist_ok=True)
+    first = attempts[0]
+    day = first.get("completed_at") or datetime.utcnow()
+    path = os.path.join(directory, f"user_progress-{day:%Y-%m-%d}-{first['_id']}.ndjson.gz")
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        for attempt in attempts:
+            f.write(json.dumps(attempt, default=_json_default, ensure_ascii=False))
+            f.write("\n")
+    with open(tmp_path, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+async def archive(db, retention_days=RETENTION_DAYS, directory=None, batch_size=BATCH_SIZE, log=print):
+    """Move summarized raw attempts older than the retention window out of user_progress"""
+    from pymongo import ReplaceOne
+
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    query = {"summarized": True, "completed_at": {"$lt": cutoff}}
+    moved = 0
+    while True:
+        attempts = await db.user_progress.find(query).sort("completed_at", 1).limit(batch_size).to_list(None)
+        if not attempts:
+            return moved
+
+        # Copy first, then delete: an interrupted batch is copied again
+        # (idempotently) on the next run rather than lost
+        if directory:
+            path = await asyncio.to_thread(write_archive_file, directory, attempts)
+            log(f"wrote {len(attempts)} attempts to {path}")
+        else:
+            await db.user_progress_archive.bulk_write(
+                [ReplaceOne({"_id": attempt["_id"]}, attempt, upsert=True) for attempt in attempts],
+                ordered=False
+            )
+        await db.user_progress.delete_many({"_id": {"$in": [attempt["_id"] for attempt in attempts]}})
+        moved += len(attempts)
+        log(f"archived {moved} attempts")
+
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="IndianDuo progress compaction and retention")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    compact_parser = subcommands.add_parser("compact", help="Fold raw attempts into lesson_progress summaries")
+    compact_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    archive_parser = subcommands.add_parser("archive", help="Move old raw attempts out of user_progress")
+    archive_parser.add_argument("--days", type=int, default=RETENTION_DAYS, help="Retention window for raw attempts")
+    archive_parser.add_argument("--to-files", metavar="DIRECTORY", help="Write gzipped NDJSON instead of user_progress_archive")
+    archive_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    from server import db
+
+    async def run():
+        await ensure_indexes(db)
+        if args.command == "compact":
+            folded = await compact(db, batch_size=args.batch_size)
+            print(f"Compacted {folded} attempts")
+        else:
+            # Only summarized attempts are archived, so fold stragglers first
+            await compact(db, batch_size=args.batch_size)
+            moved = await archive(db, retention_days=args.days, directory=args.to_files, batch_size=args.batch_size)
+            print(f"Archived {moved} attempts")
+
+    asyncio.run(run())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
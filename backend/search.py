@@ -0,0 +1,392 @@
+"""
+Multi-script search over lessons and exercises
+
+Text in any of the Brahmic scripts is transliterated to a common Latin
+skeleton, so "namaste", "नमस्ते" and "நமஸ்தே" all index to the same
+trigrams. The index is an inverted trigram index persisted in a single
+memory-mappable file; content imports apply updates on top of it and write
+a merged file, which running servers pick up on their next search.
+
+File layout (all integers little-endian):
+    magic (8 bytes) | header length (uint32) | header JSON | padding to 4 bytes
+    postings (uint32 doc numbers, grouped and sorted per trigram)
+    doc offsets (uint32, doc count + 1) | doc records (UTF-8 JSON, concatenated)
+
+Usage:
+    python search.py rebuild
+    python search.py query namaste
+"""
+
+from array import array
+from collections import defaultdict
+import asyncio
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import time
+import unicodedata
+
+INDEX_PATH = os.getenv("SEARCH_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "search.idx"))
+MAGIC = b"IDSRCH01"
+MIN_COVERAGE = 0.5
+RELOAD_CHECK_SECONDS = 5
+
+LESSON = "lesson"
+EXERCISE = "exercise"
+
+# Transliteration. Devanagari through Malayalam share one layout, 0x80
+# code points per script, so a single table keyed by offset covers them all.
+BRAHMIC_START = 0x0900
+BRAHMIC_END = 0x0D7F
+VIRAMA = 0x4D
+
+CONSONANTS = {
+    0x15: "k", 0x16: "kh", 0x17: "g", 0x18: "gh", 0x19: "n",
+    0x1A: "ch", 0x1B: "chh", 0x1C: "j", 0x1D: "jh", 0x1E: "n",
+    0x1F: "t", 0x20: "th", 0x21: "d", 0x22: "dh", 0x23: "n",
+    0x24: "t", 0x25: "th", 0x26: "d", 0x27: "dh", 0x28: "n", 0x29: "n",
+    0x2A: "p", 0x2B: "ph", 0x2C: "b", 0x2D: "bh", 0x2E: "m",
+    0x2F: "y", 0x30: "r", 0x31: "r", 0x32: "l", 0x33: "l", 0x34: "zh", 0x35: "v",
+    0x36: "sh", 0x37: "sh", 0x38: "s", 0x39: "h",
+    0x58: "q", 0x59: "kh", 0x5A: "gh", 0x5B: "z", 0x5C: "r", 0x5D: "rh", 0x5E: "f", 0x5F: "y",
+}
+VOWELS = {
+    0x05: "a", 0x06: "aa", 0x07: "i", 0x08: "ii", 0x09: "u", 0x0A: "uu", 0x0B: "ri", 0x0C: "li",
+    0x0D: "e", 0x0E: "e", 0x0F: "e", 0x10: "ai", 0x11: "o", 0x12: "o", 0x13: "o", 0x14: "au",
+    0x60: "ri", 0x61: "li",
+}
+VOWEL_SIGNS = {
+    0x3E: "aa", 0x3F: "i", 0x40: "ii", 0x41: "u", 0x42: "uu", 0x43: "ri", 0x44: "ri",
+    0x45: "e", 0x46: "e", 0x47: "e", 0x48: "ai", 0x49: "o", 0x4A: "o", 0x4B: "o", 0x4C: "au",
+    0x57: "au", 0x62: "li", 0x63: "li",
+}
+MARKS = {0x01: "n", 0x02: "n", 0x03: "h", 0x70: "n"}
+
+# Applied to both indexed text and queries so spelling variants meet
+SKELETON_RULES = [
+    (re.compile(r"ee"), "i"),
+    (re.compile(r"oo"), "u"),
+    (re.compile(r"chh"), "ch"),
+    (re.compile(r"ph"), "f"),
+    (re.compile(r"w"), "v"),
+    (re.compile(r"q"), "k"),
+    (re.compile(r"(.)\1+"), r"\1"),
+    (re.compile(r"(?<=\w\w)a\b"), ""),
+]
+TOKEN_RE = re.compile(r"\w+")
+
+def transliterate(text):
+    """Romanize Brahmic script text; other characters pass through unchanged"""
+    out = []
+    inherent = False
+    for char in text:
+        code = ord(char)
+        offset = code & 0x7F if BRAHMIC_START <= code <= BRAHMIC_END else None
+        if offset is not None and (offset in VOWEL_SIGNS or offset == VIRAMA):
+            inherent = False
+            out.append(VOWEL_SIGNS.get(offset, ""))
+            continue
+        if inherent:
+            out.append("a")
+            inherent = False
+        if offset is None:
+            out.append(char)
+        elif offset in CONSONANTS:
+            out.append(CONSONANTS[offset])
+            inherent = True
+        elif offset in VOWELS:
+            out.append(VOWELS[offset])
+        elif offset in MARKS:
+            out.append(MARKS[offset])
+        elif 0x66 <= offset <= 0x6F:
+            out.append(str(offset - 0x66))
+    if inherent:
+        out.append("a")
+    return "".join(out)
+
+def normalize(text):
+    text = transliterate(unicodedata.normalize("NFC", text or "")).casefold()
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    for pattern, replacement in SKELETON_RULES:
+        text = pattern.sub(replacement, text)
+    return text
+
+def trigrams(text):
+    grams = set()
+    for token in TOKEN_RE.findall(normalize(text)):
+        padded = f" {token} "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+def lesson_document(lesson):
+    return {
+        "key": f"{LESSON}:{lesson['id']}",
+        "id": lesson["id"],
+        "type": LESSON,
+        "language_id": lesson.get("language_id"),
+        "title": lesson.get("title", ""),
+        "text": f"{lesson.get('title', '')} {lesson.get('description', '')}",
+    }
+
+def exercise_document(exercise, language_id=None):
+    return {
+        "key": f"{EXERCISE}:{exercise['id']}",
+        "id": exercise["id"],
+        "type": EXERCISE,
+        "language_id": language_id,
+        "lesson_id": exercise.get("lesson_id"),
+        "title": exercise.get("question", ""),
+        "text": exercise.get("question", ""),
+    }
+
+class SearchIndex:
+    """Trigram index over a memory-mapped base file plus in-memory updates"""
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self.mtime = None
+        self._mmap = None
+        self._terms = {}
+        self._postings = memoryview(array("I"))
+        self._doc_offsets = memoryview(array("I", [0]))
+        self._doc_records = b""
+        self._base_count = 0
+        self._base_keys = None
+        self._removed = set()
+        self._added = []
+        self._added_postings = defaultdict(list)
+        self._added_keys = {}
+
+    @classmethod
+    def load(cls, path=INDEX_PATH):
+        index = cls(path)
+        if os.path.exists(path):
+            index._open()
+        return index
+
+    def _open(self):
+        with open(self.path, "rb") as f:
+            self.mtime = os.fstat(f.fileno()).st_mtime
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        if bytes(view[:8]) != MAGIC:
+            raise ValueError(f"{self.path} is not a search index")
+        header_length = struct.unpack_from("<I", view, 8)[0]
+        header = json.loads(bytes(view[12:12 + header_length]))
+        body = (12 + header_length + 3) & ~3
+
+        self._terms = header["terms"]
+        self._base_count = header["doc_count"]
+        postings_end = body + 4 * header["postings_length"]
+        offsets_end = postings_end + 4 * (self._base_count + 1)
+        self._postings = view[body:postings_end].cast("I")
+        self._doc_offsets = view[postings_end:offsets_end].cast("I")
+        self._doc_records = view[offsets_end:]
+
+    def __len__(self):
+        return self._base_count + len(self._added) - len(self._removed)
+
+    def _base_document(self, number):
+        start, end = self._doc_offsets[number], self._doc_offsets[number + 1]
+        return json.loads(bytes(self._doc_records[start:end]))
+
+    def document(self, number):
+        if number < self._base_count:
+            return self._base_document(number)
+        return self._added[number - self._base_count]
+
+    def _postings_for(self, gram):
+        entry = self._terms.get(gram)
+        if entry:
+            offset, count = entry
+            yield from self._postings[offset:offset + count]
+        yield from self._added_postings.get(gram, ())
+
+    # Updates
+    def _remove(self, key):
+        if self._base_keys is None:
+            # Only import and rebuild paths update the index, so the key map
+            # is built on first use rather than at load time
+            self._base_keys = {self._base_document(n)["key"]: n for n in range(self._base_count)}
+        if key in self._base_keys:
+            self._removed.add(self._base_keys[key])
+        if key in self._added_keys:
+            position = self._added_keys.pop(key)
+            self._removed.add(self._base_count + position)
+            self._added[position] = None
+
+    def add_documents(self, documents):
+        for document in documents:
+            self._remove(document["key"])
+            number = self._base_count + len(self._added)
+            record = {key: value for key, value in document.items() if key != "text"}
+            self._added_keys[document["key"]] = len(self._added)
+            self._added.append(record)
+            for gram in trigrams(document["text"]):
+                self._added_postings[gram].append(number)
+
+    def save(self, path=None):
+        """Write base and pending updates as a new compacted file, atomically"""
+        path = path or self.path
+        total = self._base_count + len(self._added)
+        renumber = {}
+        records = []
+        for number in range(total):
+            if number in self._removed:
+                continue
+            document = self.document(number)
+            renumber[number] = len(records)
+            records.append(json.dumps(document, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+        grams = set(self._terms) | set(self._added_postings)
+        terms = {}
+        postings = array("I")
+        for gram in sorted(grams):
+            numbers = sorted(renumber[n] for n in self._postings_for(gram) if n in renumber)
+            if numbers:
+                terms[gram] = [len(postings), len(numbers)]
+                postings.extend(numbers)
+
+        offsets = array("I", [0])
+        for record in records:
+            offsets.append(offsets[-1] + len(record))
+
+        header = json.dumps({
+            "doc_count": len(records),
+            "postings_length": len(postings),
+            "terms": terms,
+        }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        padding = b"\0" * (((12 + len(header) + 3) & ~3) - 12 - len(header))
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<I", len(header)))
+            f.write(header)
+            f.write(padding)
+            f.write(postings.tobytes())
+            f.write(offsets.tobytes())
+            for record in records:
+                f.write(record)
+        os.replace(tmp_path, path)
+
+    # Queries
+    def search(self, query, limit=10, type=None, language_id=None):
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+
+        document_count = max(len(self), 1)
+        weights = {}
+        scores = defaultdict(float)
+        for gram in query_grams:
+            numbers = [n for n in self._postings_for(gram) if n not in self._removed]
+            weights[gram] = math.log(1 + document_count / (1 + len(numbers)))
+            for number in numbers:
+                scores[number] += weights[gram]
+
+        total_weight = sum(weights.values())
+        candidates = [
+            (score / total_weight, -number) for number, score in scores.items()
+            if score / total_weight >= MIN_COVERAGE
+        ]
+        if type is None and language_id is None:
+            ranked = heapq.nlargest(limit, candidates)
+        else:
+            # Filters are checked against stored records, best matches first
+            ranked = sorted(candidates, reverse=True)
+
+        results = []
+        for coverage, number in ranked:
+            document = self.document(-number)
+            if type and document["type"] != type:
+                continue
+            if language_id and document.get("language_id") != language_id:
+                continue
+            results.append({**document, "score": round(coverage, 4)})
+            if len(results) >= limit:
+                break
+        return results
+
+# Index shared by the API, reloaded when an import replaces the file
+_index = None
+_last_check = 0.0
+
+def get_index(path=INDEX_PATH):
+    global _index, _last_check
+    now = time.monotonic()
+    if _index is None or now - _last_check >= RELOAD_CHECK_SECONDS:
+        _last_check = now
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if _index is None or mtime != _index.mtime:
+            _index = SearchIndex.load(path)
+    return _index
+
+async def exercise_languages(db, exercises):
+    lesson_ids = list({exercise.get("lesson_id") for exercise in exercises})
+    languages = {}
+    async for lesson in db.lessons.find({"id": {"$in": lesson_ids}}, {"_id": 0, "id": 1, "language_id": 1}):
+        languages[lesson["id"]] = lesson.get("language_id")
+    return languages
+
+async def index_content(index, db, kind, documents):
+    """Apply a batch of imported lessons or exercises to the index"""
+    if kind == "lessons":
+        index.add_documents(lesson_document(lesson) for lesson in documents)
+    else:
+        languages = await exercise_languages(db, documents)
+        index.add_documents(
+            exercise_document(exercise, languages.get(exercise.get("lesson_id")))
+            for exercise in documents
+        )
+
+async def rebuild(db, path=INDEX_PATH, batch_size=5000):
+    index = SearchIndex(path)
+    for kind, collection in (("lessons", db.lessons), ("exercises", db.exercises)):
+        batch = []
+        async for doc in collection.find({}, {"_id": 0}):
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                await index_content(index, db, kind, batch)
+                batch = []
+        if batch:
+            await index_content(index, db, kind, batch)
+    index.save()
+    return len(index)
+
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="IndianDuo search index")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("rebuild", help="Rebuild the index from the lessons and exercises collections")
+    query_parser = subcommands.add_parser("query", help="Search the index")
+    query_parser.add_argument("text")
+    query_parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    if args.command == "rebuild":
+        from server import db
+        count = asyncio.run(rebuild(db))
+        print(f"Indexed {count} documents into {INDEX_PATH}")
+    else:
+        started = time.perf_counter()
+        results = SearchIndex.load().search(args.text, limit=args.limit)
+        elapsed = (time.perf_counter() - started) * 1000
+        for result in results:
+            print(f"{result['score']:.2f}  {result['type']:<8}  {result['title']}")
+        print(f"{len(results)} results in {elapsed:.1f} ms")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
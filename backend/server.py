@@ -1,17 +1,33 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, status
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, EmailStr
-from typing import Optional, List, Dict, Any
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.encoders import jsonable_encoder
+from pydantic import AfterValidator, BaseModel, ConfigDict, EmailStr
+from typing import Annotated, Optional, List, Dict, Any
 from datetime import datetime, timedelta
-from jose import JWTError, jwt
-from passlib.context import CryptContext
-from motor.motor_asyncio import AsyncIOMotorClient
+from functools import lru_cache
+import asyncio
+import hashlib
+import json
 import os
+import time
 import uuid
-from dotenv import load_dotenv
-
-load_dotenv()
+import achievements
+import lesson_graph
+import media
+import outbox
+import progress
+import search
+import streaks
+
+# Heavy dependencies (jose, passlib/bcrypt, motor, dotenv)
+# are imported on first use so process start stays cheap; see startup_profile.py
+_env_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env")
+if os.path.exists(_env_file):
+    from dotenv import load_dotenv
+    load_dotenv(_env_file)
 
 # Configuration
 MONGO_URL = os.getenv("MONGO_URL")
@@ -31,12 +47,42 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class JSONGZipMiddleware:
+    """GZip for JSON API responses only; media is already compressed and served in byte ranges"""
+    def __init__(self, app, minimum_size=1000, skip_prefixes=("/api/media/",)):
+        self.app = app
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size)
+        self.skip_prefixes = skip_prefixes
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and not scope["path"].startswith(self.skip_prefixes):
+            await self.gzip(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+app.add_middleware(JSONGZipMiddleware, minimum_size=1000)
+
 # Database connection
-client = AsyncIOMotorClient(MONGO_URL)
-db = client.indianduo
+class LazyDatabase:
+    """Creates the Motor client on first use instead of at import time"""
+    def __init__(self, name):
+        self._name = name
+        self._database = None
+    
+    def __getattr__(self, attr):
+        if self._database is None:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            self._database = AsyncIOMotorClient(MONGO_URL)[self._name]
+        return getattr(self._database, attr)
+
+db = LazyDatabase("indianduo")
 
 # Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+@lru_cache(maxsize=None)
+def pwd_context():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
 
 # Models
@@ -46,6 +92,7 @@ class UserCreate(BaseModel):
     password: str
     native_language: str
     learning_language: str
+    timezone: Annotated[str, AfterValidator(streaks.validate_timezone)] = streaks.DEFAULT_TIMEZONE
 
 class UserLogin(BaseModel):
     username: str
@@ -55,7 +102,12 @@ class Token(BaseModel):
     access_token: str
     token_type: str
 
-class SubscriptionPlan(BaseModel):
+class DeferredModel(BaseModel):
+    """Base for storage models that no route validates on every request;
+    their validators are built on first use instead of at import"""
+    model_config = ConfigDict(defer_build=True)
+
+class SubscriptionPlan(DeferredModel):
     id: str
     name: str
     price: float
@@ -69,7 +121,7 @@ class SubscriptionPlan(BaseModel):
     advanced_features: bool = False
     ads_free: bool = False
 
-class UserSubscription(BaseModel):
+class UserSubscription(DeferredModel):
     id: str
     user_id: str
     plan_id: str
@@ -79,7 +131,7 @@ class UserSubscription(BaseModel):
     auto_renew: bool = True
     payment_method: str = "card"
 
-class User(BaseModel):
+class User(DeferredModel):
     id: str
     username: str
     email: str
@@ -97,8 +149,9 @@ class User(BaseModel):
     achievements: List[str] = []
     subscription_status: str = "free"  # free, premium, family
     subscription_expires: Optional[datetime] = None
+    timezone: str = streaks.DEFAULT_TIMEZONE  # IANA name; streak days follow this local calendar
 
-class Language(BaseModel):
+class Language(DeferredModel):
     id: str
     name: str
     code: str
@@ -107,7 +160,7 @@ class Language(BaseModel):
     total_lessons: int = 0
     difficulty_level: str = "beginner"
 
-class Lesson(BaseModel):
+class Lesson(DeferredModel):
     id: str
     language_id: str
     unit_id: str
@@ -120,7 +173,7 @@ class Lesson(BaseModel):
     prerequisites: List[str] = []
     is_locked: bool = True
 
-class Exercise(BaseModel):
+class Exercise(DeferredModel):
     id: str
     lesson_id: str
     type: str  # multiple_choice, fill_blank, translation, audio_match, etc.
@@ -132,7 +185,7 @@ class Exercise(BaseModel):
     image_url: str = ""
     difficulty: int
 
-class UserProgress(BaseModel):
+class UserProgress(DeferredModel):
     id: str
     user_id: str
     lesson_id: str
@@ -144,12 +197,14 @@ class UserProgress(BaseModel):
 
 # Utility functions
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return pwd_context().verify(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return pwd_context().hash(password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    from jose import jwt
+    
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -160,6 +215,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
+    from jose import JWTError, jwt
+    
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -177,6 +234,75 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         raise credentials_exception
     return user
 
+# Data loaders shared by endpoints and /api/bootstrap
+def load_profile(user):
+    user_data = user.copy()
+    user_data.pop("password", None)
+    # Convert ObjectId to string for JSON serialization
+    if '_id' in user_data:
+        user_data['_id'] = str(user_data['_id'])
+    return user_data
+
+async def load_languages():
+    languages = await db.languages.find({}).to_list(None)
+    # Convert ObjectId to string for JSON serialization
+    for lang in languages:
+        if '_id' in lang:
+            lang['_id'] = str(lang['_id'])
+    return languages
+
+async def load_subscription_plans():
+    plans = await db.subscription_plans.find({}).to_list(None)
+    # Convert ObjectId to string for JSON serialization
+    for plan in plans:
+        if '_id' in plan:
+            plan['_id'] = str(plan['_id'])
+    return plans
+
+async def load_current_subscription(user_id):
+    # Get user's subscription
+    subscription = await db.user_subscriptions.find_one({"user_id": user_id, "status": "active"})
+    
+    if not subscription:
+        # Return free plan details
+        free_plan = await db.subscription_plans.find_one({"name": "Free"})
+        if free_plan and '_id' in free_plan:
+            free_plan['_id'] = str(free_plan['_id'])
+        return {
+            "plan": free_plan,
+            "subscription": None,
+            "status": "free"
+        }
+    
+    # Get plan details
+    plan = await db.subscription_plans.find_one({"id": subscription["plan_id"]})
+    
+    # Convert ObjectId to string for JSON serialization
+    if subscription and '_id' in subscription:
+        subscription['_id'] = str(subscription['_id'])
+    if plan and '_id' in plan:
+        plan['_id'] = str(plan['_id'])
+    
+    return {
+        "plan": plan,
+        "subscription": subscription,
+        "status": subscription["status"]
+    }
+
+def section_etag(data):
+    """Stable ETag for one /api/bootstrap section"""
+    encoded = json.dumps(jsonable_encoder(data), sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha1(encoded).hexdigest()[:16]
+
+def parse_section_etags(header):
+    """Parse `X-Section-ETags: profile=abc, languages=def` into a dict"""
+    etags = {}
+    for item in (header or "").split(","):
+        name, _, etag = item.strip().partition("=")
+        if name and etag:
+            etags[name] = etag.strip('"')
+    return etags
+
 # Initialize subscription plans
 async def init_subscription_plans():
     plans = [
@@ -303,7 +429,8 @@ async def register(user: UserCreate):
         "friends": [],
         "achievements": [],
         "subscription_status": "free",
-        "subscription_expires": None
+        "subscription_expires": None,
+        "timezone": user.timezone
     }
     
     await db.users.insert_one(user_data)
@@ -333,23 +460,58 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     
     return {"access_token": access_token, "token_type": "bearer"}
 
+@app.get("/api/health/outbox")
+async def outbox_health():
+    """Outbox queue depth and lag per job type"""
+    return await outbox.metrics(db)
+
 @app.get("/api/user/profile")
 async def get_user_profile(current_user: dict = Depends(get_current_user)):
-    user_data = current_user.copy()
-    user_data.pop("password", None)
-    # Convert ObjectId to string for JSON serialization
-    if '_id' in user_data:
-        user_data['_id'] = str(user_data['_id'])
-    return user_data
+    return load_profile(current_user)
 
 @app.get("/api/languages")
 async def get_languages():
-    languages = await db.languages.find({}).to_list(None)
-    # Convert ObjectId to string for JSON serialization
-    for lang in languages:
-        if '_id' in lang:
-            lang['_id'] = str(lang['_id'])
-    return languages
+    return await load_languages()
+
+BOOTSTRAP_SECTIONS = ("profile", "hearts", "subscription", "languages", "plans")
+
+@app.get("/api/bootstrap")
+async def bootstrap(request: Request, sections: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    """Everything the app needs on launch, in one round trip.
+    
+    The user is resolved once and the sections are loaded concurrently.
+    Clients send the ETags they already have in `X-Section-ETags`; sections
+    that have not changed come back as {"etag": ..., "not_modified": true}.
+    """
+    requested = [name.strip() for name in sections.split(",")] if sections else list(BOOTSTRAP_SECTIONS)
+    unknown = [name for name in requested if name not in BOOTSTRAP_SECTIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown sections: {', '.join(unknown)}")
+    
+    async def hearts():
+        return {"hearts": current_user.get("hearts", 5)}
+    
+    async def profile():
+        return load_profile(current_user)
+    
+    loaders = {
+        "profile": profile,
+        "hearts": hearts,
+        "subscription": lambda: load_current_subscription(current_user["id"]),
+        "languages": load_languages,
+        "plans": load_subscription_plans
+    }
+    results = await asyncio.gather(*(loaders[name]() for name in requested))
+    
+    known_etags = parse_section_etags(request.headers.get("x-section-etags"))
+    payload = {}
+    for name, data in zip(requested, results):
+        etag = section_etag(data)
+        if known_etags.get(name) == etag:
+            payload[name] = {"etag": etag, "not_modified": True}
+        else:
+            payload[name] = {"etag": etag, "data": data}
+    return payload
 
 @app.get("/api/lessons/{language_id}")
 async def get_lessons(language_id: str, current_user: dict = Depends(get_current_user)):
@@ -372,91 +534,183 @@ async def complete_lesson(lesson_id: str, score: int, current_user: dict = Depen
         "completed_at": datetime.utcnow(),
         "mistakes": []
     }
+    event = {"attempt": progress_data}
     
-    await db.user_progress.insert_one(progress_data)
-    
-    # Update user XP and streak
+    unlocked_lessons = []
     lesson = await db.lessons.find_one({"id": lesson_id})
-    if lesson:
-        xp_gained = lesson.get("xp_reward", 10)
+    
+    # The attempt, XP/streak update and outbox jobs are written together;
+    # summaries, achievements and other consumers run out of band
+    async with outbox.transaction(db) as session:
+        # Only the first completion of a lesson counts towards lesson totals
+        if lesson:
+            first_completion, unlocked_lessons = await lesson_graph.record_completion(db, user_id, lesson, session=session)
         
-        # Check if lesson was completed today
-        today = datetime.utcnow().date()
-        last_lesson_date = current_user.get("last_lesson_date")
+        await progress.record_attempt(db, progress_data, session=session)
         
-        if last_lesson_date and last_lesson_date.date() == today:
-            # Same day, just add XP
-            await db.users.update_one(
-                {"id": user_id},
-                {"$inc": {"total_xp": xp_gained}}
-            )
-        else:
-            # New day, update streak
-            current_streak = current_user.get("current_streak", 0)
-            if last_lesson_date and (today - last_lesson_date.date()).days == 1:
-                # Consecutive day
-                new_streak = current_streak + 1
+        # Update user XP and streak
+        if lesson:
+            xp_gained = lesson.get("xp_reward", 10)
+            language_id = lesson.get("language_id")
+            counters = {"total_xp": xp_gained, **achievements.lesson_completed_counters(score, language_id, first_completion)}
+            
+            # Check if lesson was completed today, in the user's local calendar
+            new_streak, same_day = streaks.next_streak(current_user)
+            
+            if same_day:
+                # Same day, just add XP
+                await db.users.update_one(
+                    {"id": user_id},
+                    {"$inc": counters},
+                    session=session
+                )
             else:
-                # Break in streak
-                new_streak = 1
+                # New day, update streak (next_streak resets it after a missed day)
+                await db.users.update_one(
+                    {"id": user_id},
+                    {
+                        "$inc": counters,
+                        "$set": {
+                            "current_streak": new_streak,
+                            "longest_streak": max(new_streak, current_user.get("longest_streak", 0)),
+                            "last_lesson_date": datetime.utcnow()
+                        }
+                    },
+                    session=session
+                )
             
-            await db.users.update_one(
-                {"id": user_id},
-                {
-                    "$inc": {"total_xp": xp_gained},
-                    "$set": {
-                        "current_streak": new_streak,
-                        "longest_streak": max(new_streak, current_user.get("longest_streak", 0)),
-                        "last_lesson_date": datetime.utcnow()
-                    }
-                }
+            # Achievement rules are evaluated against the state before this update
+            event["achievements"] = {
+                "user_id": user_id,
+                "event": achievements.LESSON_COMPLETED,
+                "metrics": achievements.lesson_completed_metrics(
+                    current_user, xp_gained, score, language_id, new_streak, first_completion
+                ),
+                "unlocked": current_user.get("achievements", [])
+            }
+        
+        await outbox.publish(db, outbox.LESSON_COMPLETED, event, session=session)
+    
+    return {
+        "message": "Lesson completed successfully",
+        "xp_gained": xp_gained,
+        "lessons_unlocked": unlocked_lessons
+    }
+
+@app.get("/api/lessons/{language_id}/map")
+async def get_lesson_map(language_id: str, current_user: dict = Depends(get_current_user)):
+    """Get a language's lessons in prerequisite order with the user's lock state"""
+    graph = await lesson_graph.get_graph(db, language_id)
+    if not graph:
+        raise HTTPException(status_code=404, detail="Language not found")
+    completed = await lesson_graph.load_completed(db, graph, current_user["id"])
+    return {
+        "language_id": language_id,
+        "content_version": graph.version,
+        "lessons": graph.lesson_map(completed)
+    }
+
+@app.get("/api/lessons/{lesson_id}/bundle")
+async def get_lesson_bundle(lesson_id: str, current_user: dict = Depends(get_current_user)):
+    """Get a lesson with its exercises and the metadata of the media they use"""
+    lesson = await db.lessons.find_one({"id": lesson_id}, {"_id": 0})
+    if not lesson:
+        raise HTTPException(status_code=404, detail="Lesson not found")
+    
+    exercises = await db.exercises.find({"lesson_id": lesson_id}, {"_id": 0}).to_list(None)
+    digests = set()
+    for exercise in exercises:
+        for field in ("audio_url", "image_url"):
+            digest = media.find_digest(exercise.get(field))
+            if digest:
+                exercise[field] = media.media_url(digest)
+                digests.add(digest)
+    
+    return {
+        "lesson": lesson,
+        "exercises": exercises,
+        "media": await media.get_metadata(db, digests)
+    }
+
+@app.get("/api/media/{digest}")
+async def get_media(digest: str, request: Request):
+    """Serve a stored media file; content is immutable so it is cached forever"""
+    if not media.is_digest(digest):
+        raise HTTPException(status_code=404, detail="Media not found")
+    metadata = (await media.get_metadata(db, [digest])).get(digest)
+    if not metadata:
+        raise HTTPException(status_code=404, detail="Media not found")
+    
+    path = media.object_path(digest)
+    size = metadata["size"]
+    headers = {
+        "ETag": media.etag(digest),
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Accept-Ranges": "bytes"
+    }
+    
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    
+    range_header = request.headers.get("range")
+    if range_header and request.headers.get("if-range", headers["ETag"]) == headers["ETag"]:
+        try:
+            byte_range = media.parse_range(range_header, size)
+        except media.RangeNotSatisfiable:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        # A Range header we cannot parse is ignored and the full file is sent
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(
+                media.iter_file_range(path, start, end),
+                status_code=206,
+                media_type=metadata["content_type"],
+                headers=headers
             )
     
-    return {"message": "Lesson completed successfully", "xp_gained": xp_gained}
+    # FileResponse lets servers supporting the pathsend extension send the file without copying it
+    return FileResponse(
+        path,
+        media_type=metadata["content_type"],
+        headers=headers,
+        stat_result=media.stat_result(metadata)
+    )
+
+@app.get("/api/search")
+async def search_content(q: str, type: Optional[str] = None, language_id: Optional[str] = None,
+                         limit: int = 10, current_user: dict = Depends(get_current_user)):
+    """Search lessons and exercises in any script or in transliteration"""
+    if type not in (None, search.LESSON, search.EXERCISE):
+        raise HTTPException(status_code=400, detail="Invalid search type")
+    index = search.get_index()
+    results = index.search(q, limit=max(1, min(limit, 50)), type=type, language_id=language_id)
+    return {"query": q, "results": results}
+
+@app.get("/api/achievements")
+async def get_achievements(current_user: dict = Depends(get_current_user)):
+    """Get the achievements catalog with the user's unlocked state"""
+    unlocked = set(current_user.get("achievements", []))
+    return [
+        {
+            "id": rule["id"],
+            "name": rule["name"],
+            "description": rule["description"],
+            "unlocked": rule["id"] in unlocked
+        }
+        for rule in achievements.ACHIEVEMENTS
+    ]
 
 @app.get("/api/subscription/plans")
 async def get_subscription_plans():
     """Get all available subscription plans"""
-    plans = await db.subscription_plans.find({}).to_list(None)
-    # Convert ObjectId to string for JSON serialization
-    for plan in plans:
-        if '_id' in plan:
-            plan['_id'] = str(plan['_id'])
-    return plans
+    return await load_subscription_plans()
 
 @app.get("/api/subscription/current")
 async def get_current_subscription(current_user: dict = Depends(get_current_user)):
     """Get current user's subscription details"""
-    user_id = current_user["id"]
-    
-    # Get user's subscription
-    subscription = await db.user_subscriptions.find_one({"user_id": user_id, "status": "active"})
-    
-    if not subscription:
-        # Return free plan details
-        free_plan = await db.subscription_plans.find_one({"name": "Free"})
-        if free_plan and '_id' in free_plan:
-            free_plan['_id'] = str(free_plan['_id'])
-        return {
-            "plan": free_plan,
-            "subscription": None,
-            "status": "free"
-        }
-    
-    # Get plan details
-    plan = await db.subscription_plans.find_one({"id": subscription["plan_id"]})
-    
-    # Convert ObjectId to string for JSON serialization
-    if subscription and '_id' in subscription:
-        subscription['_id'] = str(subscription['_id'])
-    if plan and '_id' in plan:
-        plan['_id'] = str(plan['_id'])
-    
-    return {
-        "plan": plan,
-        "subscription": subscription,
-        "status": subscription["status"]
-    }
+    return await load_current_subscription(current_user["id"])
 
 @app.post("/api/subscription/subscribe")
 async def subscribe_to_plan(plan_id: str, current_user: dict = Depends(get_current_user)):
@@ -489,20 +743,32 @@ async def subscribe_to_plan(plan_id: str, current_user: dict = Depends(get_curre
         "payment_method": "card"
     }
     
-    await db.user_subscriptions.insert_one(subscription_data)
-    
-    # Update user subscription status
-    subscription_status = "premium" if plan["name"] == "IndianDuo Plus" else "family"
-    await db.users.update_one(
-        {"id": user_id},
-        {
-            "$set": {
-                "subscription_status": subscription_status,
-                "subscription_expires": subscription_data["expires_at"],
-                "hearts": plan["max_hearts"] if plan["unlimited_hearts"] else 5
+    async with outbox.transaction(db) as session:
+        await db.user_subscriptions.insert_one(subscription_data.copy(), session=session)
+        
+        # Update user subscription status
+        subscription_status = "premium" if plan["name"] == "IndianDuo Plus" else "family"
+        await db.users.update_one(
+            {"id": user_id},
+            {
+                "$set": {
+                    "subscription_status": subscription_status,
+                    "subscription_expires": subscription_data["expires_at"],
+                    "hearts": plan["max_hearts"] if plan["unlimited_hearts"] else 5
+                }
+            },
+            session=session
+        )
+        
+        await outbox.publish(db, outbox.SUBSCRIBED, {
+            "subscription": subscription_data,
+            "achievements": {
+                "user_id": user_id,
+                "event": achievements.SUBSCRIBED,
+                "metrics": {"subscribed": (None, 1)},
+                "unlocked": current_user.get("achievements", [])
             }
-        }
-    )
+        }, session=session)
     
     return {"message": "Subscription successful", "subscription": subscription_data}
 
@@ -530,6 +796,20 @@ async def cancel_subscription(current_user: dict = Depends(get_current_user)):
     
     return {"message": "Subscription cancelled successfully"}
 
+@app.put("/api/user/timezone")
+async def update_user_timezone(timezone: str, current_user: dict = Depends(get_current_user)):
+    """Set the timezone whose calendar days count towards the user's streak"""
+    try:
+        streaks.validate_timezone(timezone)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    await db.users.update_one(
+        {"id": current_user["id"]},
+        {"$set": {"timezone": timezone}}
+    )
+    return {"message": "Timezone updated", "timezone": timezone}
+
 @app.get("/api/user/hearts")
 async def get_user_hearts(current_user: dict = Depends(get_current_user)):
     """Get user's current hearts count"""
@@ -563,10 +843,47 @@ async def refill_hearts(current_user: dict = Depends(get_current_user)):
         else:
             raise HTTPException(status_code=400, detail="Not enough gems to refill hearts")
 
+# Initialize indexes
+async def init_indexes():
+    # Index builds on different collections are independent, so they run concurrently
+    await asyncio.gather(
+        db.lessons.create_index("language_id"),
+        db.exercises.create_index("lesson_id"),
+        progress.ensure_indexes(db),
+        outbox.ensure_indexes(db),
+        db.lesson_completion.create_index([("user_id", 1), ("language_id", 1)], unique=True),
+        db.media.create_index("id", unique=True),
+        db.users.create_index([("timezone", 1), ("last_lesson_date", 1)]),
+    )
+
+STARTUP_PROFILE = os.getenv("STARTUP_PROFILE") == "1"
+# Run the nightly streak reconciliation in this process (enable on one instance)
+STREAK_WORKER = os.getenv("STREAK_WORKER") == "1"
+startup_timings = {}
+
+async def timed_phase(name, phase):
+    started = time.perf_counter()
+    await phase()
+    startup_timings[name] = time.perf_counter() - started
+
 @app.on_event("startup")
 async def startup_event():
-    await init_subscription_plans()
-    await init_languages()
+    await asyncio.gather(
+        timed_phase("init_indexes", init_indexes),
+        timed_phase("init_subscription_plans", init_subscription_plans),
+        timed_phase("init_languages", init_languages),
+    )
+    outbox.start_workers(db)
+    if STREAK_WORKER:
+        streaks.start_worker(db)
+    if STARTUP_PROFILE:
+        for name, seconds in startup_timings.items():
+            print(f"startup phase {name}: {seconds * 1000:.1f} ms")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await outbox.stop_workers()
+    await streaks.stop_worker()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,85 @@
+"""
+Startup profiler for the IndianDuo backend
+
+Imports server.py in a fresh interpreter with `-X importtime` and reports
+the most expensive modules, then (with --phases) runs startup_event and
+reports the time spent in each of its phases.
+
+Usage:
+    python startup_profile.py
+    python startup_profile.py --top 30 --phases
+"""
+
+from collections import defaultdict
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def import_times(module="server"):
+    """Run `python -X importtime -c "import <module>"` and parse its report.
+
+    Returns [(module, self microseconds, cumulative microseconds)].
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+def report_imports(rows, top):
+    total = sum(self_us for _, self_us, _ in rows)
+    print(f"Importing server.py: {total / 1000:.1f} ms across {len(rows)} modules\n")
+
+    print(f"{'cumulative ms':>14}  {'self ms':>8}  module")
+    for name, self_us, cumulative_us in sorted(rows, key=lambda row: -row[2])[:top]:
+        print(f"{cumulative_us / 1000:>14.1f}  {self_us / 1000:>8.1f}  {name}")
+
+    # Attribute each module's own time to its top-level package
+    packages = defaultdict(int)
+    for name, self_us, _ in rows:
+        packages[name.split(".")[0]] += self_us
+    print(f"\n{'self ms':>8}  package")
+    for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+        print(f"{self_us / 1000:>8.1f}  {package}")
+
+def report_phases():
+    import asyncio
+    import time
+
+    sys.path.insert(0, BACKEND_DIR)
+    started = time.perf_counter()
+    import server
+    imported = time.perf_counter() - started
+
+    asyncio.run(server.startup_event())
+    print(f"\n{'ms':>8}  phase")
+    print(f"{imported * 1000:>8.1f}  import server")
+    for name, seconds in server.startup_timings.items():
+        print(f"{seconds * 1000:>8.1f}  startup: {name}")
+
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Profile IndianDuo backend startup")
+    parser.add_argument("--top", type=int, default=20, help="Number of modules and packages to list")
+    parser.add_argument("--phases", action="store_true", help="Also time startup_event phases (needs MongoDB)")
+    args = parser.parse_args(argv)
+
+    report_imports(import_times(), args.top)
+    if args.phases:
+        report_phases()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,183 @@
+"""
+Timezone-aware streaks for IndianDuo
+
+Streak days follow each user's local calendar rather than UTC. Lapsed
+streaks are reset by a reconciliation job that runs shortly after local
+midnight in each timezone, walking the (timezone, last_lesson_date) index
+in bounded batches.
+
+Usage:
+    python streaks.py reconcile
+    python streaks.py reconcile --timezone Asia/Kolkata
+    python streaks.py worker
+"""
+
+from datetime import datetime, time as dt_time, timedelta, timezone as dt_timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import asyncio
+import sys
+
+DEFAULT_TIMEZONE = "Asia/Kolkata"
+RECONCILE_BATCH_SIZE = 1000
+# Delay after local midnight so late lessons from the previous day have landed
+MIDNIGHT_GRACE = timedelta(minutes=5)
+# Retry delays when the schedule cannot be read, e.g. while Mongo is down
+RETRY_BASE_SECONDS = 5
+RETRY_MAX_SECONDS = 300
+
+_worker = None
+
+def validate_timezone(value):
+    try:
+        ZoneInfo(value)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"unknown timezone: {value}")
+    return value
+
+def user_timezone(user):
+    return ZoneInfo(user.get("timezone") or DEFAULT_TIMEZONE)
+
+def local_date(moment, tz):
+    """Local calendar date of a naive UTC datetime, as stored by Mongo"""
+    return moment.replace(tzinfo=dt_timezone.utc).astimezone(tz).date()
+
+def next_streak(user, now=None):
+    """Return (new streak, same local day) for a lesson completed at `now` (naive UTC)"""
+    now = now or datetime.utcnow()
+    tz = user_timezone(user)
+    today = local_date(now, tz)
+    current_streak = user.get("current_streak", 0)
+    last_lesson_date = user.get("last_lesson_date")
+
+    if last_lesson_date:
+        days = (today - local_date(last_lesson_date, tz)).days
+        if days == 0:
+            return current_streak, True
+        if days == 1:
+            return current_streak + 1, False
+    return 1, False
+
+def lapse_cutoff(tz, now=None):
+    """Naive UTC start of yesterday in `tz`; streaks last extended before it have lapsed"""
+    now = now or datetime.utcnow()
+    yesterday = local_date(now, tz) - timedelta(days=1)
+    start = datetime.combine(yesterday, dt_time.min, tzinfo=tz)
+    return start.astimezone(dt_timezone.utc).replace(tzinfo=None)
+
+def timezone_filter(name):
+    # Users created before timezones were stored count as DEFAULT_TIMEZONE
+    if name == DEFAULT_TIMEZONE:
+        return {"timezone": {"$in": [name, None]}}
+    return {"timezone": name}
+
+async def reconcile_timezone(db, name, now=None, batch_size=RECONCILE_BATCH_SIZE):
+    """Reset lapsed streaks for one timezone; returns the number of users reset"""
+    from pymongo import UpdateOne
+
+    cutoff = lapse_cutoff(ZoneInfo(name), now)
+    query = {
+        **timezone_filter(name),
+        "current_streak": {"$gt": 0},
+        "last_lesson_date": {"$lt": cutoff},
+    }
+    reset = 0
+    while True:
+        users = await db.users.find(query, {"_id": 0, "id": 1}).sort("last_lesson_date", 1).limit(batch_size).to_list(None)
+        if not users:
+            return reset
+        # Re-check the cutoff per user so a lesson finished mid-batch keeps its streak
+        operations = [
+            UpdateOne({"id": user["id"], "last_lesson_date": {"$lt": cutoff}}, {"$set": {"current_streak": 0}})
+            for user in users
+        ]
+        result = await db.users.bulk_write(operations, ordered=False)
+        reset += result.modified_count
+        if len(users) < batch_size:
+            return reset
+
+async def known_timezones(db):
+    names = {name for name in await db.users.distinct("timezone") if name}
+    names.add(DEFAULT_TIMEZONE)
+    return sorted(names)
+
+async def reconcile_all(db, now=None, log=print):
+    results = {}
+    for name in await known_timezones(db):
+        results[name] = await reconcile_timezone(db, name, now)
+        log(f"{name}: reset {results[name]} streaks")
+    return results
+
+def next_run(name, now):
+    """Naive UTC time of the next reconciliation for a timezone"""
+    tz = ZoneInfo(name)
+    today = local_date(now, tz)
+    for day in (today, today + timedelta(days=1)):
+        midnight = datetime.combine(day, dt_time.min, tzinfo=tz)
+        run_at = midnight.astimezone(dt_timezone.utc).replace(tzinfo=None) + MIDNIGHT_GRACE
+        if run_at > now:
+            return run_at
+
+async def run_forever(db, log=print):
+    """Reconcile each timezone shard right after its local midnight"""
+    failures = 0
+    while True:
+        now = datetime.utcnow()
+        try:
+            schedule = {name: next_run(name, now) for name in await known_timezones(db)}
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            failures += 1
+            delay = min(RETRY_BASE_SECONDS * 2 ** (failures - 1), RETRY_MAX_SECONDS)
+            log(f"streak worker error: {e}; retrying in {delay}s")
+            await asyncio.sleep(delay)
+            continue
+        failures = 0
+        due_at = min(schedule.values())
+        await asyncio.sleep(max((due_at - now).total_seconds(), 0))
+
+        for name, run_at in schedule.items():
+            if run_at <= datetime.utcnow():
+                try:
+                    reset = await reconcile_timezone(db, name)
+                    log(f"streak reconciliation {name}: reset {reset} streaks")
+                except Exception as e:
+                    log(f"streak reconciliation {name} failed: {e}")
+
+def start_worker(db):
+    """Start the reconciliation loop on the running event loop"""
+    global _worker
+    if _worker is None:
+        _worker = asyncio.create_task(run_forever(db))
+
+async def stop_worker():
+    global _worker
+    if _worker is None:
+        return
+    _worker.cancel()
+    await asyncio.gather(_worker, return_exceptions=True)
+    _worker = None
+
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="IndianDuo streak reconciliation")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    reconcile_parser = subcommands.add_parser("reconcile", help="Reset lapsed streaks now")
+    reconcile_parser.add_argument("--timezone", type=validate_timezone)
+    subcommands.add_parser("worker", help="Reconcile every timezone after its local midnight")
+    args = parser.parse_args(argv)
+
+    from server import db
+
+    if args.command == "worker":
+        asyncio.run(run_forever(db))
+    elif args.timezone:
+        reset = asyncio.run(reconcile_timezone(db, args.timezone))
+        print(f"{args.timezone}: reset {reset} streaks")
+    else:
+        asyncio.run(reconcile_all(db))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
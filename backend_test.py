@@ -5,13 +5,39 @@ Tests all major endpoints with realistic Indian language data
 """
 
 import requests
+import glob
+import gzip
 import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
 import time
 from datetime import datetime
 
 # Configuration
 BASE_URL = "http://localhost:8001"
 API_BASE = f"{BASE_URL}/api"
+# Content is imported with the backend's own CLIs, against the same database as the server
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+TEST_LANGUAGE_ID = "test-hindi"
+
+# Calls one collection method through the server's own database client;
+# cursors are read to a list and write results reduced to their counts
+COLLECTION_CALL = """
+import asyncio, json, sys
+from server import db
+
+async def call(collection, method, args):
+    result = getattr(getattr(db, collection), method)(*args)
+    if hasattr(result, "to_list"):
+        return await result.to_list(None)
+    result = await result
+    return getattr(result, "modified_count", result)
+
+print(json.dumps(asyncio.run(call(sys.argv[1], sys.argv[2], json.loads(sys.argv[3]))), default=str))
+"""
 
 # Test data with realistic Indian names and languages
 TEST_USER_DATA = {
@@ -27,6 +53,7 @@ class BackendTester:
         self.session = requests.Session()
         self.access_token = None
         self.test_results = []
+        self.test_lesson_id = None
         
     def log_test(self, test_name, success, message, response_data=None):
         """Log test results"""
@@ -266,6 +293,469 @@ class BackendTester:
             self.log_test("Lesson Completion", False, f"Error: {str(e)}")
             return False
     
+    def test_achievements(self):
+        """Test GET /api/achievements with authentication"""
+        if not self.access_token:
+            self.log_test("Achievements", False, "No access token available")
+            return False
+            
+        try:
+            headers = {"Authorization": f"Bearer {self.access_token}"}
+            response = self.session.get(f"{API_BASE}/achievements", headers=headers)
+            
+            if response.status_code == 200:
+                catalog = response.json()
+                
+                if isinstance(catalog, list) and all("id" in a and "unlocked" in a for a in catalog):
+                    unlocked = [a["id"] for a in catalog if a["unlocked"]]
+                    self.log_test("Achievements", True, 
+                                f"{len(catalog)} achievements, unlocked: {', '.join(unlocked) or 'none'}")
+                    return True
+                else:
+                    self.log_test("Achievements", False, f"Invalid response format: {catalog}")
+                    return False
+            else:
+                self.log_test("Achievements", False, f"HTTP {response.status_code}: {response.text}")
+                return False
+                
+        except Exception as e:
+            self.log_test("Achievements", False, f"Error: {str(e)}")
+            return False
+    
+    def run_backend_script(self, *args):
+        """Run one of the backend CLIs; returns the completed process"""
+        return subprocess.run(
+            [sys.executable, *args], cwd=BACKEND_DIR, capture_output=True, text=True, timeout=120
+        )
+    
+    def call_collection(self, collection, method, *args):
+        """Call a collection method against the server's database in a backend process"""
+        result = self.run_backend_script("-c", COLLECTION_CALL, collection, method, json.dumps(args))
+        if result.returncode != 0:
+            raise RuntimeError(f"{collection}.{method} failed: {result.stderr}")
+        return json.loads(result.stdout.strip().splitlines()[-1])
+    
+    def import_rows(self, kind, rows):
+        """Import rows through import_content.py from a temporary NDJSON file"""
+        with tempfile.NamedTemporaryFile("w", suffix=".ndjson", delete=False, encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        try:
+            result = self.run_backend_script("import_content.py", kind, f.name)
+        finally:
+            os.unlink(f.name)
+        if result.returncode != 0:
+            raise RuntimeError(f"import_content.py {kind} failed: {result.stdout}{result.stderr}")
+    
+    def ensure_test_lesson(self):
+        """Import a lesson with a Devanagari title once per run"""
+        if not self.test_lesson_id:
+            lesson_id = f"test-namaste-{int(time.time())}"
+            self.import_rows("lessons", [{
+                "id": lesson_id,
+                "language_id": TEST_LANGUAGE_ID,
+                "unit_id": "test-unit-1",
+                "title": "नमस्ते",
+                "description": "अभिवादन और परिचय",
+                "type": "reading",
+                "difficulty": 1,
+                "xp_reward": 10
+            }])
+            self.test_lesson_id = lesson_id
+        return self.test_lesson_id
+    
+    def test_search(self):
+        """Test GET /api/search finds a Devanagari lesson from a Latin transliteration"""
+        if not self.access_token:
+            self.log_test("Search", False, "No access token available")
+            return False
+            
+        try:
+            lesson_id = self.ensure_test_lesson()
+            headers = {"Authorization": f"Bearer {self.access_token}"}
+            params = {"q": "namaste", "language_id": TEST_LANGUAGE_ID}
+            
+            # The server picks up the rewritten index file within a few seconds
+            data = {}
+            for _ in range(20):
+                response = self.session.get(f"{API_BASE}/search", params=params, headers=headers)
+                if response.status_code != 200:
+                    self.log_test("Search", False, f"HTTP {response.status_code}: {response.text}")
+                    return False
+                data = response.json()
+                if any(result["id"] == lesson_id for result in data.get("results", [])):
+                    self.log_test("Search", True, "'namaste' found the lesson titled नमस्ते")
+                    return True
+                time.sleep(0.5)
+            
+            self.log_test("Search", False, f"Imported lesson {lesson_id} not found: {data}")
+            return False
+                
+        except Exception as e:
+            self.log_test("Search", False, f"Error: {str(e)}")
+            return False
+    
+    def get_lesson_map(self, headers, lesson_ids):
+        """Fetch the test language's map once the server's graph includes `lesson_ids`"""
+        # Graphs are reloaded when the server next checks the content version
+        lessons = {}
+        for _ in range(30):
+            response = self.session.get(f"{API_BASE}/lessons/{TEST_LANGUAGE_ID}/map", headers=headers)
+            if response.status_code == 200:
+                lessons = {lesson["id"]: lesson for lesson in response.json()["lessons"]}
+                if all(lesson_id in lessons for lesson_id in lesson_ids):
+                    return lessons
+            time.sleep(0.5)
+        raise RuntimeError(f"lessons {lesson_ids} missing from the map: {sorted(lessons)}")
+    
+    def test_lesson_map(self):
+        """Test GET /api/lessons/{language_id}/map unlocks a lesson once its prerequisite is completed"""
+        if not self.access_token:
+            self.log_test("Lesson Map", False, "No access token available")
+            return False
+            
+        try:
+            headers = {"Authorization": f"Bearer {self.access_token}"}
+            response = self.session.get(f"{API_BASE}/lessons/unknown-language/map", headers=headers)
+            if response.status_code != 404:
+                self.log_test("Lesson Map", False, f"Unknown language returned HTTP {response.status_code}")
+                return False
+            
+            suffix = int(time.time())
+            first_id, second_id = f"test-map-basics-{suffix}", f"test-map-phrases-{suffix}"
+            lesson = {"language_id": TEST_LANGUAGE_ID, "unit_id": "test-unit-2", "type": "reading", "difficulty": 1, "xp_reward": 10}
+            self.import_rows("lessons", [
+                {**lesson, "id": first_id, "title": "वर्णमाला", "description": "स्वर और व्यंजन"},
+                {**lesson, "id": second_id, "title": "वाक्यांश", "description": "रोज़ के वाक्यांश", "prerequisites": [first_id]},
+            ])
+            
+            lessons = self.get_lesson_map(headers, [first_id, second_id])
+            if lessons[first_id]["is_locked"] or not lessons[second_id]["is_locked"]:
+                self.log_test("Lesson Map", False, f"Expected only {second_id} locked: {lessons}")
+                return False
+            
+            response = self.session.post(f"{API_BASE}/lessons/{first_id}/complete", params={"score": 90}, headers=headers)
+            if response.status_code != 200:
+                self.log_test("Lesson Map", False, f"HTTP {response.status_code}: {response.text}")
+                return False
+            unlocked = response.json().get("lessons_unlocked", [])
+            if second_id not in unlocked:
+                self.log_test("Lesson Map", False, f"Completing {first_id} unlocked {unlocked}")
+                return False
+            
+            lessons = self.get_lesson_map(headers, [first_id, second_id])
+            if not lessons[first_id]["completed"] or lessons[second_id]["is_locked"]:
+                self.log_test("Lesson Map", False, f"Map not updated after completion: {lessons}")
+                return False
+            
+            # Another import bumps the content version, so the stored bitset is
+            # rebuilt right away, possibly before the completion is summarized
+            third_id = f"test-map-stories-{suffix}"
+            self.import_rows("lessons", [
+                {**lesson, "id": third_id, "title": "कहानियाँ", "description": "छोटी कहानियाँ", "prerequisites": [second_id]},
+            ])
+            lessons = self.get_lesson_map(headers, [first_id, second_id, third_id])
+            if lessons[first_id]["completed"] and not lessons[second_id]["is_locked"] and lessons[third_id]["is_locked"]:
+                self.log_test("Lesson Map", True, f"Completing {first_id} unlocked {second_id}, kept after a content update")
+                return True
+            else:
+                self.log_test("Lesson Map", False, f"Completion lost after a content update: {lessons}")
+                return False
+                
+        except Exception as e:
+            self.log_test("Lesson Map", False, f"Error: {str(e)}")
+            return False
+    
+    def test_progress_maintenance(self):
+        """Test progress.py compact and archive against the test user's attempts"""
+        if not self.access_token:
+            self.log_test("Progress Maintenance", False, "No access token available")
+            return False
+            
+        try:
+            headers = {"Authorization": f"Bearer {self.access_token}"}
+            lesson_id = self.ensure_test_lesson()
+            for score in (70, 100):
+                response = self.session.post(f"{API_BASE}/lessons/{lesson_id}/complete", params={"score": score}, headers=headers)
+                if response.status_code != 200:
+                    self.log_test("Progress Maintenance", False, f"HTTP {response.status_code}: {response.text}")
+                    return False
+            user_id = self.session.get(f"{API_BASE}/user/profile", headers=headers).json()["id"]
+            query = {"user_id": user_id, "lesson_id": lesson_id}
+            
+            def compact():
+                result = self.run_backend_script("progress.py", "compact")
+                if result.returncode != 0:
+                    raise RuntimeError(f"progress.py compact failed: {result.stdout}{result.stderr}")
+                return self.call_collection("lesson_progress", "find_one", query, {"_id": 0})
+            
+            summary = compact()
+            if not summary or summary["attempts"] < 2 or summary["best_score"] != 100:
+                self.log_test("Progress Maintenance", False, f"Attempts not folded: {summary}")
+                return False
+            
+            # Re-folding goes through the duplicate-key path and must not count twice
+            if compact()["attempts"] != summary["attempts"]:
+                self.log_test("Progress Maintenance", False, "A second compact changed the summary")
+                return False
+            self.call_collection("user_progress", "update_many", query, {"$set": {"summarized": False}})
+            refolded = compact()
+            if refolded["attempts"] != summary["attempts"]:
+                self.log_test("Progress Maintenance", False, f"Re-folding counted attempts twice: {refolded}")
+                return False
+            
+            attempt_ids = {attempt["id"] for attempt in self.call_collection("user_progress", "find", {"user_id": user_id}, {"id": 1})}
+            archive_dir = tempfile.mkdtemp()
+            result = self.run_backend_script("progress.py", "archive", "--days", "0", "--to-files", archive_dir)
+            if result.returncode != 0:
+                self.log_test("Progress Maintenance", False, f"progress.py archive failed: {result.stdout}{result.stderr}")
+                return False
+            archived_ids = set()
+            for path in glob.glob(os.path.join(archive_dir, "*.ndjson.gz")):
+                with gzip.open(path, "rt", encoding="utf-8") as f:
+                    archived_ids.update(row["id"] for row in map(json.loads, f) if row["user_id"] == user_id)
+            remaining = self.call_collection("user_progress", "find", {"user_id": user_id}, {"id": 1})
+            
+            if archived_ids != attempt_ids or remaining:
+                self.log_test("Progress Maintenance", False, 
+                            f"Archived {len(archived_ids)} of {len(attempt_ids)} attempts, {len(remaining)} left")
+                return False
+            if compact()["attempts"] != summary["attempts"]:
+                self.log_test("Progress Maintenance", False, "Archiving changed the summary")
+                return False
+            self.log_test("Progress Maintenance", True, 
+                        f"{summary['attempts']} attempts folded once, {len(archived_ids)} archived to files")
+            return True
+                
+        except Exception as e:
+            self.log_test("Progress Maintenance", False, f"Error: {str(e)}")
+            return False
+    
+    def test_bootstrap(self):
+        """Test GET /api/bootstrap and per-section ETags"""
+        if not self.access_token:
+            self.log_test("Bootstrap", False, "No access token available")
+            return False
+            
+        try:
+            headers = {"Authorization": f"Bearer {self.access_token}"}
+            response = self.session.get(f"{API_BASE}/bootstrap", headers=headers)
+            
+            if response.status_code != 200:
+                self.log_test("Bootstrap", False, f"HTTP {response.status_code}: {response.text}")
+                return False
+                
+            sections = response.json()
+            expected = ["profile", "hearts", "subscription", "languages", "plans"]
+            if not all(name in sections and "data" in sections[name] for name in expected):
+                self.log_test("Bootstrap", False, f"Missing sections: {list(sections)}")
+                return False
+            
+            # Sending back the ETags should mark every section as not modified
+            headers["X-Section-ETags"] = ", ".join(f"{name}={sections[name]['etag']}" for name in expected)
+            repeat = self.session.get(f"{API_BASE}/bootstrap", headers=headers).json()
+            if all(repeat[name].get("not_modified") for name in expected):
+                self.log_test("Bootstrap", True, "All sections returned, unchanged sections not modified")
+                return True
+            else:
+                self.log_test("Bootstrap", False, f"Sections resent despite matching ETags: {repeat}")
+                return False
+                
+        except Exception as e:
+            self.log_test("Bootstrap", False, f"Error: {str(e)}")
+            return False
+    
+    def test_outbox_health(self):
+        """Test GET /api/health/outbox and that queued achievement jobs drain"""
+        try:
+            response = self.session.get(f"{API_BASE}/health/outbox")
+            
+            if response.status_code != 200:
+                self.log_test("Outbox Health", False, f"HTTP {response.status_code}: {response.text}")
+                return False
+                
+            data = response.json()
+            job_types = data.get("job_types", {})
+            if not all(name in job_types for name in ("lesson_summary", "achievements")):
+                self.log_test("Outbox Health", False, f"Missing job types: {data}")
+                return False
+            
+            # A fresh user, so first_lesson can only come from this completion
+            suffix = int(time.time())
+            user_data = {**TEST_USER_DATA, "username": f"outbox_user_{suffix}", "email": f"outbox_{suffix}@example.com"}
+            response = self.session.post(f"{API_BASE}/auth/register", json=user_data)
+            if response.status_code != 200:
+                self.log_test("Outbox Health", False, f"Registration failed: HTTP {response.status_code}: {response.text}")
+                return False
+            headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+            lesson_id = self.ensure_test_lesson()
+            response = self.session.post(f"{API_BASE}/lessons/{lesson_id}/complete", params={"score": 80}, headers=headers)
+            if response.status_code != 200:
+                self.log_test("Outbox Health", False, f"HTTP {response.status_code}: {response.text}")
+                return False
+            
+            depth = {}
+            for _ in range(30):
+                catalog = self.session.get(f"{API_BASE}/achievements", headers=headers).json()
+                unlocked = any(a["id"] == "first_lesson" and a["unlocked"] for a in catalog)
+                job_types = self.session.get(f"{API_BASE}/health/outbox").json()["job_types"]
+                depth = {name: entry["pending"] + entry["running"] for name, entry in job_types.items()}
+                if unlocked and not any(depth.values()):
+                    self.log_test("Outbox Health", True, f"Mode {data.get('mode')}, first_lesson awarded and queues drained")
+                    return True
+                time.sleep(0.5)
+            
+            self.log_test("Outbox Health", False, f"first_lesson unlocked: {unlocked}, queued jobs: {depth}")
+            return False
+                
+        except Exception as e:
+            self.log_test("Outbox Health", False, f"Error: {str(e)}")
+            return False
+    
+    def test_timezone(self):
+        """Test timezone at registration and PUT /api/user/timezone"""
+        try:
+            suffix = int(time.time())
+            user_data = {
+                **TEST_USER_DATA,
+                "username": f"tz_user_{suffix}",
+                "email": f"tz_{suffix}@example.com",
+                "timezone": "Asia/Kathmandu"
+            }
+            
+            invalid = self.session.post(f"{API_BASE}/auth/register", json={**user_data, "timezone": "Mars/Olympus_Mons"})
+            if invalid.status_code != 422:
+                self.log_test("Timezone", False, f"Unknown timezone accepted at registration: HTTP {invalid.status_code}")
+                return False
+            
+            response = self.session.post(f"{API_BASE}/auth/register", json=user_data)
+            if response.status_code != 200:
+                self.log_test("Timezone", False, f"Registration failed: HTTP {response.status_code}: {response.text}")
+                return False
+            headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+            
+            profile = self.session.get(f"{API_BASE}/user/profile", headers=headers).json()
+            if profile.get("timezone") != "Asia/Kathmandu":
+                self.log_test("Timezone", False, f"Registration timezone not stored: {profile.get('timezone')}")
+                return False
+            
+            response = self.session.put(f"{API_BASE}/user/timezone", params={"timezone": "America/New_York"}, headers=headers)
+            profile = self.session.get(f"{API_BASE}/user/profile", headers=headers).json()
+            if response.status_code != 200 or profile.get("timezone") != "America/New_York":
+                self.log_test("Timezone", False, f"Timezone update failed: HTTP {response.status_code}, stored {profile.get('timezone')}")
+                return False
+            
+            response = self.session.put(f"{API_BASE}/user/timezone", params={"timezone": "Not/AZone"}, headers=headers)
+            if response.status_code != 400:
+                self.log_test("Timezone", False, f"Unknown timezone accepted: HTTP {response.status_code}")
+                return False
+            
+            self.log_test("Timezone", True, "Registration timezone stored, valid update applied, unknown zones rejected")
+            return True
+                
+        except Exception as e:
+            self.log_test("Timezone", False, f"Error: {str(e)}")
+            return False
+    
+    def test_streak_rollover(self):
+        """Test that streak days follow the user's local calendar, not UTC"""
+        try:
+            sys.path.insert(0, BACKEND_DIR)
+            import streaks
+            
+            # 18:00 UTC is 23:30 in Kolkata; 19:00 UTC is 00:30 the next local day
+            user = {"timezone": "Asia/Kolkata", "current_streak": 4, "last_lesson_date": datetime(2026, 1, 1, 18, 0)}
+            next_local_day = streaks.next_streak(user, datetime(2026, 1, 1, 19, 0))
+            # 18:00 UTC is 13:00 in New York; 23:00 UTC is still the same local day
+            user = {"timezone": "America/New_York", "current_streak": 4, "last_lesson_date": datetime(2026, 1, 1, 18, 0)}
+            same_local_day = streaks.next_streak(user, datetime(2026, 1, 1, 23, 0))
+            missed_day = streaks.next_streak(user, datetime(2026, 1, 3, 18, 0))
+            
+            if next_local_day == (5, False) and same_local_day == (4, True) and missed_day == (1, False):
+                self.log_test("Streak Rollover", True, "Streaks roll over at local midnight and reset after a missed day")
+                return True
+            self.log_test("Streak Rollover", False,
+                          f"Unexpected streaks: {next_local_day}, {same_local_day}, {missed_day}")
+            return False
+                
+        except Exception as e:
+            self.log_test("Streak Rollover", False, f"Error: {str(e)}")
+            return False
+    
+    def test_media(self):
+        """Test GET /api/lessons/{lesson_id}/bundle and GET /api/media/{digest} caching and ranges"""
+        if not self.access_token:
+            self.log_test("Media", False, "No access token available")
+            return False
+            
+        try:
+            lesson_id = self.ensure_test_lesson()
+            
+            # A small PNG (2x3 header plus unique padding), ingested through media.py
+            width, height = 2, 3
+            png = (b"\x89PNG\r\n\x1a\n" + b"\x00\x00\x00\x0dIHDR" + width.to_bytes(4, "big") + height.to_bytes(4, "big")
+                   + b"\x08\x02\x00\x00\x00" + os.urandom(4) + os.urandom(4096))
+            with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as f:
+                f.write(png)
+            try:
+                result = self.run_backend_script("media.py", "ingest", f.name)
+            finally:
+                os.unlink(f.name)
+            match = re.search(r"/api/media/([0-9a-f]{64})", result.stdout)
+            if result.returncode != 0 or not match:
+                self.log_test("Media", False, f"media.py ingest failed: {result.stdout}{result.stderr}")
+                return False
+            digest = match.group(1)
+            url = f"{API_BASE}/media/{digest}"
+            
+            self.import_rows("exercises", [{
+                "id": f"test-image-{digest[:12]}",
+                "lesson_id": lesson_id,
+                "type": "image_match",
+                "question": "नमस्ते का चित्र चुनें",
+                "options": ["a", "b"],
+                "correct_answer": "a",
+                "image_url": digest,
+                "difficulty": 1
+            }])
+            headers = {"Authorization": f"Bearer {self.access_token}"}
+            bundle = self.session.get(f"{API_BASE}/lessons/{lesson_id}/bundle", headers=headers).json()
+            metadata = bundle.get("media", {}).get(digest, {})
+            if (not any(exercise.get("image_url") == f"/api/media/{digest}" for exercise in bundle.get("exercises", []))
+                    or (metadata.get("width"), metadata.get("height"), metadata.get("size")) != (width, height, len(png))):
+                self.log_test("Media", False, f"Bundle missing media metadata: {bundle}")
+                return False
+            
+            full = self.session.get(url, headers={"Accept-Encoding": "gzip"})
+            etag = full.headers.get("ETag")
+            if full.status_code != 200 or full.content != png or not etag or "Content-Encoding" in full.headers:
+                self.log_test("Media", False, f"Full response: HTTP {full.status_code}, headers {dict(full.headers)}")
+                return False
+            
+            checks = [
+                ("If-None-Match", {"If-None-Match": etag}, 304, None, b""),
+                ("Range", {"Range": "bytes=0-99", "Accept-Encoding": "gzip"}, 206, f"bytes 0-99/{len(png)}", png[:100]),
+                ("suffix Range", {"Range": "bytes=-10"}, 206, f"bytes {len(png) - 10}-{len(png) - 1}/{len(png)}", png[-10:]),
+                ("unsatisfiable Range", {"Range": f"bytes={len(png)}-"}, 416, f"bytes */{len(png)}", None),
+                ("multi-range Range", {"Range": "bytes=0-1,5-6"}, 200, None, png),
+                ("malformed Range", {"Range": "bytes=abc"}, 200, None, png),
+            ]
+            for name, request_headers, expected_status, content_range, body in checks:
+                response = self.session.get(url, headers=request_headers)
+                if (response.status_code != expected_status
+                        or response.headers.get("Content-Range") != content_range
+                        or (body is not None and response.content != body)
+                        or "Content-Encoding" in response.headers):
+                    self.log_test("Media", False, f"{name}: HTTP {response.status_code}, headers {dict(response.headers)}")
+                    return False
+            
+            self.log_test("Media", True, "Bundle metadata, ETag/304, ranges (206/416) and ignored bad ranges all correct")
+            return True
+                
+        except Exception as e:
+            self.log_test("Media", False, f"Error: {str(e)}")
+            return False
+    
     def run_all_tests(self):
         """Run all backend tests in sequence"""
         print("🚀 Starting IndianDuo Backend API Tests")
@@ -278,7 +768,16 @@ class BackendTester:
             ("User Registration", self.test_user_registration),
             ("User Login", self.test_user_login),
             ("Protected Profile", self.test_protected_profile),
-            ("Lesson Completion", self.test_lesson_completion)
+            ("Lesson Completion", self.test_lesson_completion),
+            ("Achievements", self.test_achievements),
+            ("Search", self.test_search),
+            ("Media", self.test_media),
+            ("Lesson Map", self.test_lesson_map),
+            ("Progress Maintenance", self.test_progress_maintenance),
+            ("Bootstrap", self.test_bootstrap),
+            ("Outbox Health", self.test_outbox_health),
+            ("Timezone", self.test_timezone),
+            ("Streak Rollover", self.test_streak_rollover)
         ]
         
         passed = 0
@@ -3,6 +3,9 @@ import axios from 'axios';
 
 const AuthContext = createContext();
 
+// Bootstrap sections the app reads on launch; hearts come with the profile
+const LAUNCH_SECTIONS = ['profile', 'subscription', 'languages', 'plans'];
+
 export const useAuth = () => {
   const context = useContext(AuthContext);
   if (!context) {
@@ -13,6 +16,7 @@ export const useAuth = () => {
 
 export const AuthProvider = ({ children }) => {
   const [user, setUser] = useState(null);
+  const [launchData, setLaunchData] = useState({});
   const [loading, setLoading] = useState(true);
   const [token, setToken] = useState(localStorage.getItem('token'));
 
@@ -27,13 +31,30 @@ export const AuthProvider = ({ children }) => {
     }
   }, [token]);
 
-  // Load user profile on mount
+  // Load launch data on mount in a single request, reusing cached sections
+  // the server reports as not modified
   useEffect(() => {
     const loadUser = async () => {
       if (token) {
         try {
-          const response = await axios.get(`${API_BASE_URL}/api/user/profile`);
-          setUser(response.data);
+          const cached = JSON.parse(localStorage.getItem('bootstrap') || '{}');
+          const etags = LAUNCH_SECTIONS
+            .filter((name) => cached[name])
+            .map((name) => `${name}=${cached[name].etag}`)
+            .join(', ');
+          const response = await axios.get(`${API_BASE_URL}/api/bootstrap`, {
+            params: { sections: LAUNCH_SECTIONS.join(',') },
+            headers: etags ? { 'X-Section-ETags': etags } : {}
+          });
+          const sections = {};
+          const data = {};
+          Object.entries(response.data).forEach(([name, section]) => {
+            sections[name] = section.not_modified ? cached[name] : section;
+            data[name] = sections[name].data;
+          });
+          localStorage.setItem('bootstrap', JSON.stringify(sections));
+          setLaunchData(data);
+          setUser(data.profile);
         } catch (error) {
           console.error('Failed to load user:', error);
           localStorage.removeItem('token');
@@ -94,10 +115,17 @@ export const AuthProvider = ({ children }) => {
     }
   };
 
+  // Keep a launch section current after the app changes it, e.g. a new subscription
+  const updateLaunchData = (name, data) => {
+    setLaunchData((previous) => ({ ...previous, [name]: data }));
+  };
+
   const logout = () => {
     setToken(null);
     setUser(null);
+    setLaunchData({});
     localStorage.removeItem('token');
+    localStorage.removeItem('bootstrap');
     delete axios.defaults.headers.common['Authorization'];
   };
 
@@ -120,6 +148,8 @@ export const AuthProvider = ({ children }) => {
 
   const value = {
     user,
+    launchData,
+    updateLaunchData,
     loading,
     login,
     register,
@@ -1,5 +1,6 @@
 import React, { createContext, useContext, useState, useEffect } from 'react';
 import axios from 'axios';
+import { useAuth } from './AuthContext';
 
 const LanguageContext = createContext();
 
@@ -12,6 +13,7 @@ export const useLanguage = () => {
 };
 
 export const LanguageProvider = ({ children }) => {
+  const { loading: authLoading, launchData } = useAuth();
   const [languages, setLanguages] = useState([]);
   const [selectedLanguage, setSelectedLanguage] = useState(null);
   const [lessons, setLessons] = useState([]);
@@ -19,8 +21,16 @@ export const LanguageProvider = ({ children }) => {
 
   const API_BASE_URL = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8001';
 
-  // Load available languages
+  // Load available languages, from the launch data when signed in
   useEffect(() => {
+    if (authLoading) {
+      return;
+    }
+    if (launchData.languages) {
+      setLanguages(launchData.languages);
+      return;
+    }
+
     const loadLanguages = async () => {
       try {
         const response = await axios.get(`${API_BASE_URL}/api/languages`);
@@ -31,7 +41,7 @@ export const LanguageProvider = ({ children }) => {
     };
 
     loadLanguages();
-  }, [API_BASE_URL]);
+  }, [authLoading, launchData, API_BASE_URL]);
 
   const loadLessons = async (languageId) => {
     setLoading(true);
@@ -51,7 +51,9 @@ const Register = () => {
       email: formData.email,
       password: formData.password,
       native_language: formData.native_language,
-      learning_language: formData.learning_language
+      learning_language: formData.learning_language,
+      // Streak days follow the learner's local calendar
+      timezone: Intl.DateTimeFormat().resolvedOptions().timeZone || 'Asia/Kolkata'
     };
 
     const result = await register(userData);
@@ -4,7 +4,7 @@ import { Check, Crown, Users, Star, Zap, Shield, Download, Heart } from 'lucide-
 import axios from 'axios';
 
 const Subscription = () => {
-  const { user } = useAuth();
+  const { user, loading: authLoading, launchData, updateLaunchData } = useAuth();
   const [plans, setPlans] = useState([]);
   const [currentSubscription, setCurrentSubscription] = useState(null);
   const [loading, setLoading] = useState(true);
@@ -12,10 +12,20 @@ const Subscription = () => {
 
   const API_BASE_URL = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8001';
 
+  // Plans and the current subscription arrive with the launch data when signed in
   useEffect(() => {
+    if (authLoading) {
+      return;
+    }
+    if (launchData.plans && launchData.subscription) {
+      setPlans(launchData.plans);
+      setCurrentSubscription(launchData.subscription);
+      setLoading(false);
+      return;
+    }
     loadPlans();
     loadCurrentSubscription();
-  }, []);
+  }, [authLoading, launchData]);
 
   const loadPlans = async () => {
     try {
@@ -30,6 +40,9 @@ const Subscription = () => {
     try {
       const response = await axios.get(`${API_BASE_URL}/api/subscription/current`);
       setCurrentSubscription(response.data);
+      if (launchData.subscription) {
+        updateLaunchData('subscription', response.data);
+      }
     } catch (error) {
       console.error('Failed to load subscription:', error);
     } finally {